@@ -1,5 +1,6 @@
 import os
 import sys
+import errno
 import re
 import yaml
 import textwrap
@@ -9,49 +10,174 @@ import time
 import random
 import hashlib
 import threading
+import functools
+import contextlib
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import shutil
+import tempfile
 import json
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as YamlLoader
+from PIL import Image, ImageColor, ImageDraw, ImageFont
 
 # Module-level caches (thread-safe for our usage: writes are idempotent).
-_PROBE_PIX_FMT_CACHE: dict[str, str] = {}
-_PROBE_LOCK = threading.Lock()
 _MANIFEST_PATH = ".cache/segments_manifest.json"
+_TITLE_CACHE_DIR = ".cache/titles"
 _MANIFEST_LOCK = threading.Lock()
 
 # --- Helper Functions ---
+@functools.lru_cache(maxsize=4096)
+def _stat(path: str) -> os.stat_result | None:
+    """Cached `os.stat` for run-constant inputs (LUTs, timers, SFX, BGM, source).
+
+    Returns None when the path is missing. Do not use for files created during
+    the run (temp segments); call `_nonempty_file` for those instead.
+    """
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def _nonempty_file(path: str) -> bool:
+    """Uncached single-`stat` check that `path` exists and has data."""
+    try:
+        return os.stat(path).st_size > 0
+    except OSError:
+        return False
+
+# None of the escapes below produce a character that a later escape would touch,
+# so one translate pass gives the same result as applying them one after another.
+_DRAWTEXT_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    "'": "'\\\\\\''",
+    '"': '\\"',
+    '%': '\\%',
+    ':': '\\:',
+})
+
+_AFORMAT_STEREO_48K = "aformat=sample_fmts=fltp:sample_rates=48000:channel_layouts=stereo"
+
+_LOUDNORM_JSON_RE = re.compile(r'\{[^{}]*"input_i"[^{}]*\}', re.DOTALL)
+
+def load_yaml(path: str):
+    """Parses a YAML file with the libyaml C loader when available."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=YamlLoader)
+
+def escape_filter_path(path: str) -> str:
+    """Makes a file path safe to embed in a filter option (forward slashes, escaped colons)."""
+    return path.replace('\\', '/').replace(':', '\\:')
+
 def sanitize_text_for_ffmpeg(text: str) -> str:
     """Escapes characters that are special to FFmpeg's drawtext filter."""
-    text = text.replace('\\', '\\\\')
-    text = text.replace("'", "'\\\\\\''")
-    text = text.replace('"', '\\"')
-    text = text.replace('%', '\\%')
-    text = text.replace(':', '\\:')
-    return text
+    return text.translate(_DRAWTEXT_ESCAPES)
+
+@functools.lru_cache(maxsize=512)
+def wrap_text(text: str, line_width: int = 25) -> str:
+    """Wraps text onto lines of at most `line_width` characters."""
+    wrapped_lines = textwrap.wrap(text, width=line_width, break_long_words=True, replace_whitespace=True)
+    return "\n".join(wrapped_lines)
 
+@functools.lru_cache(maxsize=512)
 def prepare_text_for_ffmpeg(text: str, line_width: int = 25) -> str:
     """Wraps text and sanitizes it for the drawtext filter."""
-    wrapped_lines = textwrap.wrap(text, width=line_width, break_long_words=True, replace_whitespace=True)
-    wrapped_text = "\n".join(wrapped_lines)
-    return sanitize_text_for_ffmpeg(wrapped_text)
-
-def probe_pix_fmt(path):
-    """Probes video file to get its pixel format. Cached per path."""
-    cached = _PROBE_PIX_FMT_CACHE.get(path)
-    if cached is not None:
-        return cached
-    cmd = ['ffprobe','-v','error','-select_streams','v:0',
-           '-show_entries','stream=pix_fmt','-of','default=nw=1:nk=1', path]
+    return sanitize_text_for_ffmpeg(wrap_text(text, line_width))
+
+def _parse_ffmpeg_color(color: str) -> tuple[int, int, int, int]:
+    """Parses an FFmpeg colour ('white', '0xRRGGBB', 'black@0.7') into RGBA."""
+    name, _, alpha = color.partition('@')
+    if name.lower().startswith('0x'):
+        name = '#' + name[2:]
+    r, g, b = ImageColor.getrgb(name)[:3]
+    return (r, g, b, round(float(alpha) * 255) if alpha else 255)
+
+# drawtext position expressions name the frame `w`/`h` and the text `text_w`/
+# `text_h`; overlay names the frame `W`/`H` and the overlaid image `w`/`h`, which
+# here is the text plus its box border on every side.
+_EXPR_IDENT_RE = re.compile(r'[A-Za-z_]+')
+
+def _drawtext_pos_to_overlay(expr, border: int) -> str:
+    """Rewrites a drawtext x/y expression for an overlay of the boxed title PNG."""
+    names = {'w': 'W', 'h': 'H', 'main_w': 'W', 'main_h': 'H',
+             'text_w': f'(w-{2 * border})', 'tw': f'(w-{2 * border})',
+             'text_h': f'(h-{2 * border})', 'th': f'(h-{2 * border})'}
+    expr = _EXPR_IDENT_RE.sub(lambda m: names.get(m.group(0), m.group(0)), str(expr))
+    return f"({expr})-{border}"
+
+def render_title_png(text: str, title_cfg: dict) -> str:
+    """Rasterizes a segment title (text plus its background box) to an RGBA PNG.
+
+    drawtext re-renders the same static title with freetype on every frame; a
+    pre-rendered PNG is rendered once and blended with `overlay` instead. The
+    PNG is cached under .cache/titles/, keyed on the text, the font file
+    (path + mtime + size) and the styling.
+    """
+    font_file = title_cfg.get('font_file', '')
+    font_size = int(title_cfg.get('font_size', 80))
+    border = int(title_cfg.get('box_border_width', 15))
+    font_color = title_cfg.get('font_color', 'white')
+    box_color = title_cfg.get('box_color', 'black@0.7')
+    font_stat = _stat(font_file)
+    key = hashlib.sha256(json.dumps([
+        text, font_file, font_stat.st_mtime_ns if font_stat else None, font_stat.st_size if font_stat else None,
+        font_size, border, font_color, box_color,
+    ]).encode('utf-8')).hexdigest()[:16]
+    out_path = os.path.join(_TITLE_CACHE_DIR, f"title_{key}.png")
+    if _nonempty_file(out_path):
+        return out_path
+
+    font = ImageFont.truetype(font_file, font_size)
+    left, top, right, bottom = ImageDraw.Draw(Image.new('RGBA', (1, 1))).multiline_textbbox((0, 0), text, font=font)
+    size = (right - left + 2 * border, bottom - top + 2 * border)
+    box = Image.new('RGBA', size, _parse_ffmpeg_color(box_color))
+    glyphs = Image.new('RGBA', size, (0, 0, 0, 0))
+    ImageDraw.Draw(glyphs).multiline_text((border - left, border - top), text, font=font,
+                                         fill=_parse_ffmpeg_color(font_color))
+    os.makedirs(_TITLE_CACHE_DIR, exist_ok=True)
+    # Parallel workers may render the same title; write-then-rename keeps
+    # readers from ever seeing a partial PNG.
+    tmp_path = f"{out_path}.{threading.get_ident()}.tmp"
+    Image.alpha_composite(box, glyphs).save(tmp_path, format='PNG')
+    os.replace(tmp_path, out_path)
+    return out_path
+
+@functools.lru_cache(maxsize=256)
+def _probe_file_cached(path: str, mtime_ns: int, size: int) -> dict:
+    cmd = ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_streams', '-show_format', path]
     try:
-        result = subprocess.check_output(cmd, text=True).strip()
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        print(f"WARNING: Could not probe pixel format for {path}. Defaulting to yuv420p.")
-        result = 'yuv420p'
-    with _PROBE_LOCK:
-        _PROBE_PIX_FMT_CACHE[path] = result
-    return result
+        data = json.loads(subprocess.check_output(cmd, text=True, encoding='utf-8'))
+    except FileNotFoundError:
+        print("WARNING: ffprobe not found in PATH. Cannot probe media files.")
+        data = None
+    except (subprocess.CalledProcessError, json.JSONDecodeError):
+        data = None
+    if data is None:
+        return {'valid': False, 'pix_fmt': 'yuv420p'}
+    streams = data.get('streams', [])
+    video = next((st for st in streams if st.get('codec_type') == 'video'), {})
+    audio = next((st for st in streams if st.get('codec_type') == 'audio'), {})
+    return {
+        'valid': True,
+        'pix_fmt': video.get('pix_fmt', 'yuv420p'),
+        'width': str(video.get('width', '')), 'height': str(video.get('height', '')),
+        'vcodec': video.get('codec_name'), 'acodec': audio.get('codec_name'),
+        'duration': data.get('format', {}).get('duration'),
+    }
+
+def probe_file(path: str) -> dict:
+    """One ffprobe per file: validity, pix_fmt, size, codecs and duration.
 
+    Cached on (path, mtime, size), so repeat calls for the same source skip the
+    ffprobe spawn while an edited or re-rendered file is probed again.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return {'valid': False, 'pix_fmt': 'yuv420p'}
+    return _probe_file_cached(path, st.st_mtime_ns, st.st_size)
 
 def _load_manifest() -> dict:
     if not os.path.exists(_MANIFEST_PATH):
@@ -75,14 +201,14 @@ def _update_manifest_entry(key: str, value: str) -> None:
 def _prune_manifest(active_paths: set[str]) -> None:
     """Drop manifest entries whose temp files no longer exist or are not in `active_paths`.
 
-    Prevents the manifest from accumulating stale keys (e.g. after a
-    single-segment finalize that moves the temp into the output path).
+    Prevents the manifest from accumulating stale keys (e.g. after the
+    routine shrinks or a temp from an older run is deleted).
     """
     with _MANIFEST_LOCK:
         manifest = _load_manifest()
         before = len(manifest)
         pruned = {k: v for k, v in manifest.items()
-                  if k in active_paths and os.path.exists(k) and os.path.getsize(k) > 0}
+                  if k in active_paths and _nonempty_file(k)}
         if len(pruned) != before:
             Path(_MANIFEST_PATH).parent.mkdir(parents=True, exist_ok=True)
             with open(_MANIFEST_PATH, 'w', encoding='utf-8') as f:
@@ -94,134 +220,260 @@ def _segment_fingerprint(payload: dict) -> str:
     blob = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
     return hashlib.sha256(blob).hexdigest()
 
+def _prefetch_source(path: str) -> None:
+    """Warm the OS page cache for `path` so parallel workers' reads hit RAM.
+
+    Every worker opens and seeks the same source file; without this, N
+    concurrent readers thrash the disk. Linux gets a non-blocking
+    POSIX_FADV_WILLNEED hint; elsewhere a daemon thread streams the file once.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+        return
+
+    def read_through() -> None:
+        buf = bytearray(8 * 1024 * 1024)
+        try:
+            with open(path, 'rb', buffering=0) as f:
+                while f.readinto(buf):
+                    pass
+        except OSError:
+            pass
+
+    threading.Thread(target=read_through, name='source-prefetch', daemon=True).start()
+
 def is_video_file_valid(path: str) -> bool:
-    """Checks if a video file is valid and readable by running a silent ffprobe command."""
-    if not os.path.exists(path) or os.path.getsize(path) == 0:
-        return False
-    cmd = ['ffprobe', '-v', 'error', '-i', path]
-    try:
-        subprocess.run(cmd, check=True, capture_output=True, text=True, encoding='utf-8')
-        return True
-    except subprocess.CalledProcessError:
-        return False
-    except FileNotFoundError:
-        print("WARNING: ffprobe not found in PATH. Cannot validate segments; will re-render if necessary.")
+    """Checks if a video file is valid and readable via its (cached) ffprobe record."""
+    if not _nonempty_file(path):
         return False
+    return probe_file(path)['valid']
 
-def optimize_final_audio(config_path: str, video_file_path: str, verbose: bool = False):
-    """
-    Performs a two-pass loudness normalization on the final video file.
-    Crucially, this uses `-c:v copy` on the second pass to avoid re-encoding video.
+_STDERR_TAIL_BYTES = 64 * 1024
+
+def run_ffmpeg(cmd: list[str], verbose: bool = False) -> None:
+    """Runs an ffmpeg command, raising CalledProcessError on failure.
+
+    Verbose runs stream straight to the terminal. Otherwise stderr is spooled
+    to an anonymous temp file rather than a pipe, so a long encode's log never
+    sits in Python memory; on failure its tail is attached as `e.stderr`.
     """
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            cfg = yaml.safe_load(f)
-    except FileNotFoundError:
-        print(f"WARNING: Config file not found at '{config_path}', skipping final audio optimization.")
+    if verbose:
+        subprocess.run(cmd, check=True)
         return
+    with tempfile.TemporaryFile() as err:
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=err)
+        except subprocess.CalledProcessError as e:
+            err.seek(max(0, err.seek(0, os.SEEK_END) - _STDERR_TAIL_BYTES))
+            e.stderr = err.read().decode('utf-8', errors='replace')
+            raise
 
+def _loudness_normalization_enabled(cfg: dict) -> bool:
+    """True when `optimize_final_audio` will rewrite the joined file."""
     opt_cfg = cfg.get('audio_optimization', {})
-    norm_cfg = opt_cfg.get('loudness_normalization', {})
+    return bool(opt_cfg.get('enabled') and opt_cfg.get('loudness_normalization', {}).get('enabled'))
+
+def optimize_final_audio(config_path: str, video_file_path: str, verbose: bool = False,
+                         cfg: dict | None = None):
+    """
+    Performs loudness normalization on the final video file.
+    Two-pass (default) measures first and then applies linear normalization;
+    `loudness_normalization.mode: one_pass` uses loudnorm's dynamic mode in a
+    single decode. Either way the video stream is copied, never re-encoded.
+    Pass an already-parsed `cfg` to skip re-reading `config_path`.
+    """
+    if cfg is None:
+        try:
+            cfg = load_yaml(config_path)
+        except FileNotFoundError:
+            print(f"WARNING: Config file not found at '{config_path}', skipping final audio optimization.")
+            return
+
+    norm_cfg = cfg.get('audio_optimization', {}).get('loudness_normalization', {})
 
-    if not opt_cfg.get('enabled') or not norm_cfg.get('enabled'):
+    if not _loudness_normalization_enabled(cfg):
         print("\n--- Final audio optimization disabled in config. Skipping. ---")
         return
 
     print("\n--- 🔊 Performing Final Audio Optimization ---")
-    
-    # --- PASS 1: ANALYSIS ---
-    print("  > Step 1/2: Analyzing audio loudness...")
     target_i = norm_cfg.get('target_i', -16)
     target_lra = norm_cfg.get('target_lra', 11)
     target_tp = norm_cfg.get('target_tp', -1.5)
+    loudnorm_filter = f'loudnorm=I={target_i}:LRA={target_lra}:tp={target_tp}'
+    one_pass = norm_cfg.get('mode', 'two_pass') == 'one_pass'
 
-    pass1_cmd = [
-        'ffmpeg', '-i', video_file_path, '-af',
-        f'loudnorm=I={target_i}:LRA={target_lra}:tp={target_tp}:print_format=json',
-        '-f', 'null', '-'
-    ]
-    
-    try:
-        # We need to capture stderr because ffmpeg writes loudnorm stats there
-        result = subprocess.run(pass1_cmd, check=True, capture_output=True, text=True, encoding='utf-8')
-    except subprocess.CalledProcessError as e:
-        print("\n--- FATAL: FFmpeg failed during audio analysis pass. ---")
-        print("  > FFmpeg error output (stderr):\n", e.stderr)
-        sys.exit(1)
-        
-    # Extract the loudnorm JSON object from the messy stderr. We can't just
-    # slice from first '{' to last '}' because other filters may emit braces;
-    # find a brace block that contains the 'input_i' key instead.
-    json_match = re.search(r'\{[^{}]*"input_i"[^{}]*\}', result.stderr, re.DOTALL)
-    json_str = json_match.group(0) if json_match else ""
-
-    if not json_str:
-        print("\n--- FATAL: Could not find loudnorm JSON data in FFmpeg output. ---")
-        print("  > FFmpeg output:\n", result.stderr)
-        sys.exit(1)
-        
-    try:
-        loudnorm_stats = json.loads(json_str)
-        if verbose: print("    - Analysis complete. Stats:", loudnorm_stats)
-    except json.JSONDecodeError:
-        print("\n--- FATAL: Failed to parse loudnorm JSON data. ---")
-        print("  > Raw string for parsing:\n", json_str)
-        sys.exit(1)
+    if one_pass:
+        print("  > Single-pass mode: skipping loudness analysis.")
+    else:
+        # --- PASS 1: ANALYSIS ---
+        print("  > Step 1/2: Analyzing audio loudness...")
+        # -vn/-sn/-dn: only the audio needs decoding to measure loudness; skipping
+        # the video decode removes the dominant cost of this pass.
+        # -nostats/-hide_banner keep stderr down to the filter's own report
+        # instead of thousands of progress lines over a long video.
+        pass1_cmd = [
+            'ffmpeg', '-hide_banner', '-nostats', '-i', video_file_path, '-vn', '-sn', '-dn', '-af',
+            f'{loudnorm_filter}:print_format=json',
+            '-f', 'null', '-'
+        ]
+
+        try:
+            # We need to capture stderr because ffmpeg writes loudnorm stats there
+            result = subprocess.run(pass1_cmd, check=True, capture_output=True, text=True, encoding='utf-8')
+        except subprocess.CalledProcessError as e:
+            print("\n--- FATAL: FFmpeg failed during audio analysis pass. ---")
+            print("  > FFmpeg error output (stderr):\n", e.stderr)
+            sys.exit(1)
+
+        # Extract the loudnorm JSON object from the messy stderr. We can't just
+        # slice from first '{' to last '}' because other filters may emit braces;
+        # find a brace block that contains the 'input_i' key instead. loudnorm
+        # prints it when the filter closes, so it sits at the end of stderr.
+        json_match = (_LOUDNORM_JSON_RE.search(result.stderr, max(0, len(result.stderr) - 8192))
+                      or _LOUDNORM_JSON_RE.search(result.stderr))
+        json_str = json_match.group(0) if json_match else ""
+
+        if not json_str:
+            print("\n--- FATAL: Could not find loudnorm JSON data in FFmpeg output. ---")
+            print("  > FFmpeg output:\n", result.stderr)
+            sys.exit(1)
+
+        try:
+            loudnorm_stats = json.loads(json_str)
+            if verbose: print("    - Analysis complete. Stats:", loudnorm_stats)
+        except json.JSONDecodeError:
+            print("\n--- FATAL: Failed to parse loudnorm JSON data. ---")
+            print("  > Raw string for parsing:\n", json_str)
+            sys.exit(1)
+
+        loudnorm_filter += (
+            f":measured_i={loudnorm_stats['input_i']}:"
+            f"measured_lra={loudnorm_stats['input_lra']}:"
+            f"measured_tp={loudnorm_stats['input_tp']}:"
+            f"measured_thresh={loudnorm_stats['input_thresh']}:"
+            f"offset={loudnorm_stats['target_offset']}"
+        )
 
     # --- PASS 2: APPLYING NORMALIZATION ---
-    print("  > Step 2/2: Applying normalization (video stream will be copied)...")
-    
+    step = "Step 1/1" if one_pass else "Step 2/2"
+    print(f"  > {step}: Applying normalization (video stream will be copied)...")
+
     # Prepare a temporary output path to avoid read/write conflicts
     original_path = Path(video_file_path)
     temp_output_path = original_path.with_name(f"{original_path.stem}_temp_normalized{original_path.suffix}")
 
     pass2_cmd = [
-        'ffmpeg', '-y', '-i', video_file_path, '-af',
-        (f"loudnorm=I={target_i}:LRA={target_lra}:tp={target_tp}:"
-         f"measured_i={loudnorm_stats['input_i']}:"
-         f"measured_lra={loudnorm_stats['input_lra']}:"
-         f"measured_tp={loudnorm_stats['input_tp']}:"
-         f"measured_thresh={loudnorm_stats['input_thresh']}:"
-         f"offset={loudnorm_stats['target_offset']}"),
+        'ffmpeg', '-y', '-i', video_file_path, '-af', loudnorm_filter,
         '-c:v', 'copy',  # <-- This is the magic part!
         '-c:a', cfg.get('video_output', {}).get('audio_codec', 'aac'),
         '-b:a', cfg.get('video_output', {}).get('audio_bitrate', '192k'),
+        '-movflags', '+faststart',  # this pass writes the final file
         str(temp_output_path)
     ]
-    
+
     try:
-        subprocess.run(pass2_cmd, check=True, capture_output=not verbose, text=True, encoding='utf-8')
+        run_ffmpeg(pass2_cmd, verbose)
         print(f"    - Normalization successful.")
     except subprocess.CalledProcessError as e:
         print("\n--- FATAL: FFmpeg failed during audio normalization pass. ---")
         if not verbose: print("  > FFmpeg error output (stderr):\n", e.stderr)
         sys.exit(1)
-        
-    # Replace original with the new normalized file
-    os.remove(video_file_path)
-    shutil.move(str(temp_output_path), video_file_path)
+
+    # Replace original with the new normalized file. Both live in the same
+    # directory, so this is a single atomic rename; the original is never
+    # missing if something fails midway.
+    try:
+        os.replace(temp_output_path, video_file_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(str(temp_output_path), video_file_path)
     print("  > Final audio optimized successfully.")
 
+_TIMER_ASSET_RE = re.compile(r'timer_(\d+)s\.mov')
+
+def _scan_timer_assets(timers_dir: str) -> dict[int, str]:
+    """Maps duration (s) -> path for every timer_<N>s.mov in one directory read."""
+    try:
+        with os.scandir(timers_dir) as entries:
+            return {int(m.group(1)): entry.path for entry in entries
+                    if (m := _TIMER_ASSET_RE.fullmatch(entry.name)) and entry.is_file()}
+    except OSError:  # missing, not a directory, unreadable: no timers
+        return {}
+
+def _ffmpeg_threads_per_invocation(n_workers: int) -> int:
+    """Splits the CPU evenly across concurrent ffmpeg processes.
+
+    `ROUTINE_FFMPEG_THREADS_PER_INVOCATION` (clamped to 1..64) overrides the
+    computed value.
+    """
+    override = os.environ.get('ROUTINE_FFMPEG_THREADS_PER_INVOCATION')
+    if override:
+        try:
+            return min(64, max(1, int(override)))
+        except ValueError:
+            print(f"WARNING: Ignoring invalid ROUTINE_FFMPEG_THREADS_PER_INVOCATION={override!r}.")
+    return max(1, (os.cpu_count() or n_workers) // max(1, n_workers))
+
 # --- Per-Segment Renderer (parallel-safe) ---
-def _render_segment(task: dict, ctx: dict, verbose_mode: bool) -> list[str]:
-    """Render one segment to its temp_segment_<i>.mp4 file.
+def _encoder_args(video_cfg: dict, threads: str) -> list[str]:
+    """Video/audio encoder options shared by single-segment and batch renders."""
+    bit_depth = int(video_cfg.get('bit_depth', 8))
+    pix_fmt = 'p010le' if bit_depth == 10 else 'yuv420p'
+    args = [
+        '-c:v', video_cfg['codec'], '-preset', video_cfg['preset'], '-cq', str(video_cfg['quality']),
+        '-pix_fmt', pix_fmt, '-c:a', video_cfg['audio_codec'], '-b:a', video_cfg['audio_bitrate'],
+        '-color_range', 'tv', '-colorspace', 'bt709', '-color_primaries', 'bt709', '-color_trc', 'bt709',
+    ]
+    if video_cfg.get('codec') in ('h264_nvenc', 'hevc_nvenc'):
+        # 'qres' (quarter-res first pass) is ~1.5x faster than 'fullres' with
+        # quality differences typically <0.05 dB PSNR -- visually indistinguishable.
+        # `-rc-lookahead 8` (was 20) keeps each NVENC session's VRAM footprint
+        # ~2.5x smaller; quality impact at high CQ is negligible.
+        args += [
+            '-rc-lookahead', '8', '-spatial_aq', '1', '-temporal_aq', '1', '-aq-strength', '8',
+            '-rc', 'vbr', '-tune', 'hq', '-multipass', 'qres', '-bf', '3',
+        ]
+        if video_cfg.get('codec') == 'hevc_nvenc':
+            args += ['-profile:v', 'main10' if bit_depth == 10 else 'main']
+    args += ['-threads', threads]
+    return args
 
-    `task` carries fully resolved per-segment data (no shared mutation).
-    `ctx`  carries shared, read-only config dicts plus pre-baked LUT path(s).
 
-    Returns a list of log strings; the caller prints them when the future
-    completes so each segment's logs stay grouped together.
+def _ffmpeg_prefix(ctx: dict) -> tuple[list[str], str]:
+    """Global ffmpeg options plus the per-process thread count."""
+    # CPU-side lut3d/zscale/unsharp scale across cores, but N parallel workers
+    # each auto-sizing to every core oversubscribe the CPU; give each ffmpeg
+    # its share (cpu_count // workers) instead.
+    threads = str(ctx.get('ffmpeg_threads') or _ffmpeg_threads_per_invocation(1))
+    return (['ffmpeg', '-y', '-filter_threads', threads, '-filter_complex_threads', threads], threads)
+
+
+def _build_segment_graph(task: dict, ctx: dict, log, input_base: int = 0, tag: str = "",
+                         trim: bool = False) -> tuple[list[str], list[str], str, str]:
+    """Build one segment's ffmpeg inputs and filter chains.
+
+    Input indices start at `input_base` and every filter label gets `tag`
+    appended, so several segments can share one filter_complex. With `trim`,
+    both outputs are cut to the segment length inside the graph (needed when
+    an output-level `-t` can't be used).
+
+    Returns (input_args, filter_chains, video_label, audio_label).
     """
-    logs: list[str] = []
-    def log(msg: str) -> None:
-        logs.append(msg)
+    def lbl(name: str) -> str:
+        return f"[{name}{tag}]"
 
     cfg = ctx['cfg']
-    paths_cfg = ctx['paths_cfg']
-    video_cfg = dict(ctx['video_cfg'])  # per-task copy in case codec switches
+    video_cfg = ctx['video_cfg']
     title_cfg = ctx['title_cfg']
     ring_cfg = ctx['ring_cfg']
-    source_cfg = ctx['source_cfg']
     finish_cfg = ctx['finish_cfg']
     sfx_cfg = ctx['sfx_cfg']
     bgm_cfg = ctx['bgm_cfg']
@@ -229,7 +481,6 @@ def _render_segment(task: dict, ctx: dict, verbose_mode: bool) -> list[str]:
 
     name = task['name']
     length = task['length']
-    output_segment_file = task['output']
     final_video_input_path = task['video_input_path']
     final_video_input_args = task['video_input_args']
     final_audio_input_path = task['audio_input_path']
@@ -254,17 +505,18 @@ def _render_segment(task: dict, ctx: dict, verbose_mode: bool) -> list[str]:
     else:
         log("    - WARNING: Timer not found. Skipping overlay.")
 
-    # NOTE: '-threads 1 -filter_threads 0' previously forced single-threaded CPU
-    # filtering. CPU-side lut3d/zscale/unsharp scale across cores; let FFmpeg
-    # pick its own thread count.
-    # `-extra_hw_frames 2` keeps the per-worker VRAM footprint small so 3+
-    # parallel workers don't push 4K p010 buffers into shared (system) memory.
-    ffmpeg_cmd = ['ffmpeg', '-y', '-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda',
-                  '-extra_hw_frames', '2']
-
-    current_input_index = 0
-    ffmpeg_cmd.extend(final_video_input_args)
-    ffmpeg_cmd.extend(['-i', final_video_input_path])
+    input_args: list[str] = []
+    current_input_index = input_base
+    # `-threads` before a CPU-decoded `-i` caps that input's decoder at this
+    # process's share of the cores (as an output option it only reaches the encoder).
+    cpu_decode = ['-threads', str(ctx.get('ffmpeg_threads') or _ffmpeg_threads_per_invocation(1))]
+    # Hardware decoding options are per-input, so every segment's video input
+    # gets its own copy (a batch has one per segment). `-extra_hw_frames 2`
+    # keeps the per-worker VRAM footprint small so 3+ parallel workers don't
+    # push 4K p010 buffers into shared (system) memory.
+    input_args.extend(['-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda', '-extra_hw_frames', '2'])
+    input_args.extend(final_video_input_args)
+    input_args.extend(['-i', final_video_input_path])
     video_stream_spec = f"[{current_input_index}:v]"
     video_input_stream_index = current_input_index
     current_input_index += 1
@@ -272,21 +524,21 @@ def _render_segment(task: dict, ctx: dict, verbose_mode: bool) -> list[str]:
     if final_audio_input_path == final_video_input_path and final_audio_input_args == final_video_input_args:
         audio_stream_spec = f"[{video_input_stream_index}:a:0]"
     else:
-        ffmpeg_cmd.extend(final_audio_input_args)
-        ffmpeg_cmd.extend(['-i', final_audio_input_path])
+        input_args.extend(final_audio_input_args)
+        input_args.extend([*cpu_decode, '-i', final_audio_input_path])
         audio_stream_spec = f"[{current_input_index}:a:0]"
         current_input_index += 1
 
-    timer_input_index = sfx_input_index = bgm_input_index = -1
+    timer_input_index = sfx_input_index = bgm_input_index = title_input_index = -1
 
     if use_timer:
-        ffmpeg_cmd.extend(['-i', timer_file])
+        input_args.extend([*cpu_decode, '-i', timer_file])
         timer_input_index = current_input_index
         current_input_index += 1
 
     if use_bgm:
         log("    - Found background music.")
-        ffmpeg_cmd.extend(['-ss', str(bgm_offset), '-i', background_music_path])
+        input_args.extend([*cpu_decode, '-ss', str(bgm_offset), '-i', background_music_path])
         bgm_input_index = current_input_index
         current_input_index += 1
 
@@ -296,71 +548,100 @@ def _render_segment(task: dict, ctx: dict, verbose_mode: bool) -> list[str]:
         sfx_path = effect_details.get('file')
         sfx_layout = effect_details.get('layout', 'stereo')
         log(f"    - Applying sound effect: '{effect_name}'")
-        ffmpeg_cmd.extend(['-channel_layout', sfx_layout, '-i', sfx_path])
+        input_args.extend([*cpu_decode, '-channel_layout', sfx_layout, '-i', sfx_path])
         sfx_input_index = current_input_index
         current_input_index += 1
 
+    title_png = None
+    if title_cfg.get('prerender', True):
+        try:
+            title_png = render_title_png(wrap_text(name, title_cfg.get('wrap_at_char', 25)), title_cfg)
+        except (OSError, ValueError) as e:
+            log(f"    - WARNING: Could not pre-render title ({e}). Falling back to drawtext.")
+    if title_png:
+        input_args.extend([*cpu_decode, '-i', title_png])
+        title_input_index = current_input_index
+        current_input_index += 1
+
     log("  > Step 2/3: Building FFmpeg command...")
     target_res = video_cfg['resolution']
     W, H = target_res.split('x')
     target_res_colon = f"{W}:{H}"
-    in_pix = probe_pix_fmt(final_video_input_path)
+    in_probe = probe_file(final_video_input_path)
+    if not in_probe['valid']:
+        log(f"    - WARNING: Could not probe {final_video_input_path}. Assuming yuv420p.")
+    in_pix = in_probe['pix_fmt']
+    # A source already at the target size needs neither the scale nor the crop;
+    # unless a GPU format conversion is due, wire it straight into hwdownload.
+    native_res = (in_probe.get('width'), in_probe.get('height')) == (W, H)
     bit_depth = int(video_cfg.get('bit_depth', 8))
-    pix_fmt = 'p010le' if bit_depth == 10 else 'yuv420p'
     cpu_download_fmt = 'p010le' if '10' in in_pix else 'nv12'
-
-    if bit_depth == 10 and 'h264' in video_cfg.get('codec', ''):
-        video_cfg['codec'] = 'hevc_nvenc'
+    # Without a LUT chain nothing on the CPU side needs a 10-bit source's extra
+    # precision for an 8-bit output: convert to nv12 in VRAM so hwdownload moves
+    # half the bytes per frame across PCIe.
+    gpu_to_nv12 = cpu_download_fmt == 'p010le' and bit_depth == 8 and not effective_luts
+    if gpu_to_nv12:
+        cpu_download_fmt = 'nv12'
 
     filter_complex_chains: list[str] = []
 
-    cpu_filters = [f"[gpu_scaled]hwdownload,format={cpu_download_fmt},setpts=PTS-STARTPTS"]
-    if video_cfg.get('framing_method') == 'crop':
+    gpu_pass = not native_res or gpu_to_nv12
+    gpu_stream = lbl("gpu_scaled") if gpu_pass else video_stream_spec
+    cpu_filters = [f"{gpu_stream}hwdownload,format={cpu_download_fmt},setpts=PTS-STARTPTS"]
+    if video_cfg.get('framing_method') == 'crop' and not native_res:
         cpu_filters.append(f"crop={W}:{H}:floor((iw-{W})/4)*2:floor((ih-{H})/4)*2")
     sharpen_cfg = finish_cfg.get('sharpen', {})
-    if effective_luts:
-        # Skip the BT.2020/HLG roundtrip the original code did -- a no-op for
-        # V-Log -> Rec.709 LUT chains and an expensive zscale pair.
-        cpu_filters.append("zscale=rin=tv:r=full")
-        for lut_file in effective_luts:
-            log(f"    - Applying LUT: {os.path.basename(lut_file)}")
-            lut_path = lut_file.replace('\\', '/').replace(':', '\\:')
-            cpu_filters.append(f"lut3d=file='{lut_path}':interp=tetrahedral")
-        cpu_filters.append(f"zscale=rin=full:r=limited,format={pix_fmt}")
+    if ctx.get('lut_filter'):
+        log(f"    - Applying LUT: {ctx['lut_names']}")
+        cpu_filters.append(ctx['lut_filter'])
     if sharpen_cfg.get('enabled', False):
         cpu_filters.append(f"unsharp=lx=3:ly=3:la={sharpen_cfg.get('luma_amount', 0.5)}")
-    last_stream = "[cpu_processed]"
-    filter_complex_chains.extend([
-        f"{video_stream_spec}scale_cuda={target_res_colon}:force_original_aspect_ratio=increase[gpu_scaled]",
-        ",".join(cpu_filters) + last_stream,
-    ])
+    last_stream = lbl("cpu_processed")
+    if gpu_pass:
+        scale_opts = [] if native_res else [f"{target_res_colon}:force_original_aspect_ratio=increase"]
+        if gpu_to_nv12:
+            scale_opts.append("format=nv12")
+        filter_complex_chains.append(f"{video_stream_spec}scale_cuda={':'.join(scale_opts)}{lbl('gpu_scaled')}")
+    filter_complex_chains.append(",".join(cpu_filters) + last_stream)
+    # Overlays only need 10-bit 4:4:4 precision when the output is 10-bit; for
+    # 8-bit output yuva420p matches the main stream and halves the blend traffic.
+    overlay_pix_fmt = 'yuva444p10le' if bit_depth == 10 else 'yuva420p'
     if use_timer:
         pos = ring_cfg.get('position', {})
         ring_size = ring_cfg.get('size', 600)
-        timer_pix_fmt = 'yuva444p10le'
         filter_complex_chains.extend([
-            f"[{timer_input_index}:v]scale={ring_size}:-1,format={timer_pix_fmt}[timer]",
-            f"{last_stream}[timer]overlay=x='{pos.get('x', '(W-w)/2')}':y='{pos.get('y', '50')}'[with_timer]",
+            f"[{timer_input_index}:v]scale={ring_size}:-1,format={overlay_pix_fmt}{lbl('timer')}",
+            f"{last_stream}{lbl('timer')}overlay=x='{pos.get('x', '(W-w)/2')}':y='{pos.get('y', '50')}'{lbl('with_timer')}",
         ])
-        last_stream = "[with_timer]"
-    clean_text = prepare_text_for_ffmpeg(name, title_cfg.get('wrap_at_char', 25))
-    font_path = title_cfg.get('font_file', '').replace('\\', '/').replace(':', '\\:')
-    video_chain_suffix = (
-        f"drawtext=fontfile='{font_path}':text='{clean_text}':"
-        f"fontsize={title_cfg.get('font_size', 80)}:fontcolor={title_cfg.get('font_color', 'white')}:"
-        f"box=1:boxcolor={title_cfg.get('box_color', 'black@0.7')}:"
-        f"boxborderw={title_cfg.get('box_border_width', 15)}:"
-        f"x='{title_cfg.get('position_x', '(w-text_w)/2')}':y='{title_cfg.get('position_y', 'h*0.8')}',"
-        f"setsar=1[final_v]"
-    )
-    filter_complex_chains.append(f"{last_stream}{video_chain_suffix}")
+        last_stream = lbl("with_timer")
+    finish_suffix = "setsar=1" + (f",trim=duration={length}" if trim else "") + lbl("final_v")
+    if title_png:
+        border = int(title_cfg.get('box_border_width', 15))
+        title_x = _drawtext_pos_to_overlay(title_cfg.get('position_x', '(w-text_w)/2'), border)
+        title_y = _drawtext_pos_to_overlay(title_cfg.get('position_y', 'h*0.8'), border)
+        filter_complex_chains.extend([
+            f"[{title_input_index}:v]format={overlay_pix_fmt}{lbl('title')}",
+            f"{last_stream}{lbl('title')}overlay=x='{title_x}':y='{title_y}',{finish_suffix}",
+        ])
+    else:
+        clean_text = prepare_text_for_ffmpeg(name, title_cfg.get('wrap_at_char', 25))
+        font_path = escape_filter_path(title_cfg.get('font_file', ''))
+        video_chain_suffix = (
+            f"drawtext=fontfile='{font_path}':text='{clean_text}':"
+            f"fontsize={title_cfg.get('font_size', 80)}:fontcolor={title_cfg.get('font_color', 'white')}:"
+            f"box=1:boxcolor={title_cfg.get('box_color', 'black@0.7')}:"
+            f"boxborderw={title_cfg.get('box_border_width', 15)}:"
+            f"x='{title_cfg.get('position_x', '(w-text_w)/2')}':y='{title_cfg.get('position_y', 'h*0.8')}',"
+            f"{finish_suffix}"
+        )
+        filter_complex_chains.append(f"{last_stream}{video_chain_suffix}")
 
     audio_streams_to_mix: list[str] = []
     audio_filter_chains: list[str] = []
     audio_opt_cfg = cfg.get('audio_optimization', {})
     vocal_enhance_cfg = audio_opt_cfg.get('vocal_enhancement', {})
     main_audio_chain_parts = [
-        f"{audio_stream_spec}aformat=sample_fmts=fltp:sample_rates=48000:channel_layouts=stereo,asetpts=PTS-STARTPTS"
+        f"{audio_stream_spec}{_AFORMAT_STEREO_48K},asetpts=PTS-STARTPTS"
     ]
     if audio_opt_cfg.get('enabled') and vocal_enhance_cfg.get('enabled'):
         log("    - Applying vocal enhancement (EQ/Compression)...")
@@ -372,99 +653,197 @@ def _render_segment(task: dict, ctx: dict, verbose_mode: bool) -> list[str]:
         main_audio_chain_parts.append(f"equalizer=f={pb_hz}:width_type=q:width=2:g={pb_db}")
         if comp_params:
             main_audio_chain_parts.append(comp_params)
-    audio_filter_chains.append(",".join(main_audio_chain_parts) + "[main_a]")
-    audio_streams_to_mix.append("[main_a]")
+    audio_filter_chains.append(",".join(main_audio_chain_parts) + lbl("main_a"))
+    audio_streams_to_mix.append(lbl("main_a"))
 
     bgm_stream_for_mixing, sfx_stream_for_mixing = "", ""
     if use_bgm:
         bgm_vol = float(bgm_cfg.get('master_volume', 1.0))
         audio_filter_chains.append(
-            f"[{bgm_input_index}:a]aformat=sample_fmts=fltp:sample_rates=48000:channel_layouts=stereo,"
-            f"volume={bgm_vol:.2f}[bgm_vol]"
+            f"[{bgm_input_index}:a]{_AFORMAT_STEREO_48K},"
+            f"volume={bgm_vol:.2f}{lbl('bgm_vol')}"
         )
-        bgm_stream_for_mixing = "[bgm_vol]"
+        bgm_stream_for_mixing = lbl("bgm_vol")
 
     if sfx_rule_to_apply:
         sfx_details = sfx_cfg['effects'][sfx_rule_to_apply['effect']]
         sfx_vol = sfx_details.get('volume', 1.0) * sfx_cfg.get('master_volume', 1.0)
         delay_ms = sfx_delay_ms
         audio_filter_chains.append(
-            f"[{sfx_input_index}:a]aformat=sample_fmts=fltp:sample_rates=48000:channel_layouts=stereo,"
-            f"volume={sfx_vol:.2f},adelay={delay_ms}|{delay_ms}[delayed_sfx]"
+            f"[{sfx_input_index}:a]{_AFORMAT_STEREO_48K},"
+            f"volume={sfx_vol:.2f},adelay={delay_ms}|{delay_ms}{lbl('delayed_sfx')}"
         )
-        sfx_stream_for_mixing = "[delayed_sfx]"
+        sfx_stream_for_mixing = lbl("delayed_sfx")
 
     ducking_enabled = bgm_cfg.get('ducking_enabled', False)
     if use_bgm and sfx_stream_for_mixing and ducking_enabled:
         duck_vol_ratio = bgm_cfg.get('ducking_volume', 0.2)
-        audio_filter_chains.append(f"{sfx_stream_for_mixing}asplit[sfx_mix][sfx_sc]")
-        sfx_stream_for_mixing = "[sfx_mix]"
+        audio_filter_chains.append(f"{sfx_stream_for_mixing}asplit{lbl('sfx_mix')}{lbl('sfx_sc')}")
+        sfx_stream_for_mixing = lbl("sfx_mix")
         audio_filter_chains.append(
-            f"{bgm_stream_for_mixing}[sfx_sc]sidechaincompress=threshold=0.01:ratio=5:level_sc={duck_vol_ratio}[bgm_ducked]"
+            f"{bgm_stream_for_mixing}{lbl('sfx_sc')}sidechaincompress=threshold=0.01:ratio=5:level_sc={duck_vol_ratio}{lbl('bgm_ducked')}"
         )
-        bgm_stream_for_mixing = "[bgm_ducked]"
+        bgm_stream_for_mixing = lbl("bgm_ducked")
 
     if bgm_stream_for_mixing:
         audio_streams_to_mix.append(bgm_stream_for_mixing)
     if sfx_stream_for_mixing:
         audio_streams_to_mix.append(sfx_stream_for_mixing)
 
-    final_audio_stream = "[main_a]"
+    final_audio_stream = lbl("main_a")
     if len(audio_streams_to_mix) > 1:
         mix_inputs_str = "".join(audio_streams_to_mix)
         audio_filter_chains.append(
-            f"{mix_inputs_str}amix=inputs={len(audio_streams_to_mix)}:duration=first:dropout_transition=1[mixed_a]"
+            f"{mix_inputs_str}amix=inputs={len(audio_streams_to_mix)}:duration=first:dropout_transition=1{lbl('mixed_a')}"
         )
-        final_audio_stream = "[mixed_a]"
+        final_audio_stream = lbl("mixed_a")
 
     audio_map_target = final_audio_stream
     if video_cfg.get('audio_channels', 2) == 1:
-        audio_filter_chains.append(f"{final_audio_stream}pan=mono|c0=c0[final_a]")
-        audio_map_target = "[final_a]"
+        audio_filter_chains.append(f"{final_audio_stream}pan=mono|c0=c0{lbl('final_a')}")
+        audio_map_target = lbl("final_a")
+    if trim:
+        audio_filter_chains.append(f"{audio_map_target}atrim=duration={length}{lbl('trimmed_a')}")
+        audio_map_target = lbl("trimmed_a")
 
     filter_complex_chains.extend(audio_filter_chains)
-    filter_complex = ";".join(filter_complex_chains)
+    return input_args, filter_complex_chains, lbl("final_v"), audio_map_target
 
-    final_cmd_args = ['-filter_complex', filter_complex, '-map', '[final_v]', '-map', audio_map_target]
-    final_cmd_args.extend([
-        '-c:v', video_cfg['codec'], '-preset', video_cfg['preset'], '-cq', str(video_cfg['quality']),
-        '-pix_fmt', pix_fmt, '-c:a', video_cfg['audio_codec'], '-b:a', video_cfg['audio_bitrate'],
-        '-color_range', 'tv', '-colorspace', 'bt709', '-color_primaries', 'bt709', '-color_trc', 'bt709',
-    ])
-    if video_cfg.get('codec') in ('h264_nvenc', 'hevc_nvenc'):
-        # 'qres' (quarter-res first pass) is ~1.5x faster than 'fullres' with
-        # quality differences typically <0.05 dB PSNR -- visually indistinguishable.
-        # `-rc-lookahead 8` (was 20) keeps each NVENC session's VRAM footprint
-        # ~2.5x smaller; quality impact at high CQ is negligible.
-        final_cmd_args += [
-            '-rc-lookahead', '8', '-spatial_aq', '1', '-temporal_aq', '1', '-aq-strength', '8',
-            '-rc', 'vbr', '-tune', 'hq', '-multipass', 'qres', '-bf', '3',
-        ]
-        if video_cfg.get('codec') == 'hevc_nvenc':
-            final_cmd_args += ['-profile:v', 'main10' if bit_depth == 10 else 'main']
-    ffmpeg_cmd.extend(final_cmd_args)
-    ffmpeg_cmd.extend(['-t', str(length), output_segment_file])
 
-    if verbose_mode:
-        log("    - Assembled FFmpeg command: " + ' '.join(f'"{c}"' for c in ffmpeg_cmd))
-
-    log("  > Step 3/3: Encoding with FFmpeg...")
-    encoding_start_time = time.monotonic()
+def _run_encode(ffmpeg_cmd: list[str], ctx: dict, verbose_mode: bool, what: str) -> None:
+    # Only NVENC jobs count against the GPU's encoder session limit.
+    nvenc_gate = ctx.get('nvenc_gate') if 'nvenc' in ctx['video_cfg']['codec'] else None
     try:
-        subprocess.run(ffmpeg_cmd, check=True, capture_output=not verbose_mode, text=True, encoding='utf-8')
+        with nvenc_gate or contextlib.nullcontext():
+            run_ffmpeg(ffmpeg_cmd, verbose_mode)
     except subprocess.CalledProcessError as e:
         err_tail = (e.stderr or '').strip().splitlines()[-30:] if e.stderr else []
         raise RuntimeError(
-            f"FFmpeg failed on segment '{name}':\n" + "\n".join(err_tail)
+            f"FFmpeg failed on {what}:\n" + "\n".join(err_tail)
         ) from e
-    log(f"    - Done. Segment encoded in {time.monotonic() - encoding_start_time:.2f}s.")
+
+
+def _render_segment(task: dict, ctx: dict, verbose_mode: bool) -> list[str]:
+    """Render one segment to its temp_segment_<i>.ts file.
+
+    `task` carries fully resolved per-segment data (no shared mutation).
+    `ctx`  carries shared, read-only config dicts plus pre-baked LUT path(s).
+
+    Returns a list of log strings; the caller prints them when the future
+    completes so each segment's logs stay grouped together.
+    """
+    logs: list[str] = []
+    ffmpeg_cmd, threads = _ffmpeg_prefix(ctx)
+    input_args, chains, video_label, audio_label = _build_segment_graph(task, ctx, logs.append)
+    ffmpeg_cmd.extend(input_args)
+    ffmpeg_cmd.extend(['-filter_complex', ";".join(chains), '-map', video_label, '-map', audio_label])
+    ffmpeg_cmd.extend(_encoder_args(ctx['video_cfg'], threads))
+    # MPEG-TS segments concatenate at the byte level. Offsetting each one to its
+    # place on the routine timeline keeps timestamps monotonic across the join.
+    ffmpeg_cmd.extend(['-t', str(task['length']), '-f', 'mpegts',
+                       '-output_ts_offset', str(task['timeline_offset']), task['output']])
+
+    if verbose_mode:
+        logs.append("    - Assembled FFmpeg command: " + ' '.join(f'"{c}"' for c in ffmpeg_cmd))
+
+    logs.append("  > Step 3/3: Encoding with FFmpeg...")
+    encoding_start_time = time.monotonic()
+    _run_encode(ffmpeg_cmd, ctx, verbose_mode, f"segment '{task['name']}'")
+    logs.append(f"    - Done. Segment encoded in {time.monotonic() - encoding_start_time:.2f}s.")
 
     if task.get('fingerprint'):
-        _update_manifest_entry(output_segment_file, task['fingerprint'])
+        _update_manifest_entry(task['output'], task['fingerprint'])
 
     return logs
 
 
+def _render_segment_batch(batch: list[dict], ctx: dict, verbose_mode: bool) -> list[str]:
+    """Render a run of timeline-contiguous segments in ONE ffmpeg process.
+
+    Each segment keeps its own sub-graph; the sub-graphs are concatenated and
+    encoded once, so the process start, CUDA context and NVENC session are paid
+    once per batch instead of once per segment. Keyframes are forced at the
+    segment boundaries and the segment muxer splits the stream back into the
+    usual per-segment temp files, so the manifest cache works unchanged.
+    """
+    logs: list[str] = []
+    ffmpeg_cmd, threads = _ffmpeg_prefix(ctx)
+    chains: list[str] = []
+    concat_inputs = ""
+    input_base = 0
+    for k, task in enumerate(batch):
+        input_args, seg_chains, video_label, audio_label = _build_segment_graph(
+            task, ctx, logs.append, input_base=input_base, tag=f"_{k}", trim=True)
+        ffmpeg_cmd.extend(input_args)
+        input_base += input_args.count('-i')
+        chains.extend(seg_chains)
+        concat_inputs += video_label + audio_label
+    chains.append(f"{concat_inputs}concat=n={len(batch)}:v=1:a=1[batch_v][batch_a]")
+    ffmpeg_cmd.extend(['-filter_complex', ";".join(chains), '-map', '[batch_v]', '-map', '[batch_a]'])
+    ffmpeg_cmd.extend(_encoder_args(ctx['video_cfg'], threads))
+
+    # Boundaries relative to the batch start (encoder side) and absolute on the
+    # routine timeline (segment muxer side, which sees -output_ts_offset).
+    first_offset = batch[0]['timeline_offset']
+    boundaries: list[float] = []
+    elapsed = 0.0
+    for task in batch[:-1]:
+        elapsed += task['length']
+        boundaries.append(elapsed)
+    pattern = f"temp_batch_{batch[0]['i']}_%03d.ts"
+    ffmpeg_cmd.extend([
+        '-force_key_frames', ",".join(f"{b:.6f}" for b in boundaries),
+        '-f', 'segment', '-segment_format', 'mpegts', '-reset_timestamps', '0',
+        '-segment_times', ",".join(f"{first_offset + b:.6f}" for b in boundaries),
+        '-output_ts_offset', str(first_offset), pattern,
+    ])
+
+    if verbose_mode:
+        logs.append("    - Assembled FFmpeg command: " + ' '.join(f'"{c}"' for c in ffmpeg_cmd))
+
+    names = ", ".join(f"'{t['name']}'" for t in batch)
+    logs.append(f"  > Step 3/3: Encoding {len(batch)} segments in one FFmpeg process...")
+    encoding_start_time = time.monotonic()
+    try:
+        _run_encode(ffmpeg_cmd, ctx, verbose_mode, f"segments {names}")
+        for k, task in enumerate(batch):
+            part = pattern % k
+            if not _nonempty_file(part):
+                raise RuntimeError(f"Segment muxer did not produce '{part}' for segment '{task['name']}'.")
+            os.replace(part, task['output'])
+            if task.get('fingerprint'):
+                _update_manifest_entry(task['output'], task['fingerprint'])
+    finally:
+        # A failed encode leaves partial segment-muxer parts behind; drop any
+        # that weren't moved into place.
+        for k in range(len(batch)):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(pattern % k)
+    logs.append(f"    - Done. {len(batch)} segments encoded in {time.monotonic() - encoding_start_time:.2f}s.")
+
+    return logs
+
+
+def _render_unit(unit: list[dict], ctx: dict, verbose_mode: bool) -> list[str]:
+    if len(unit) == 1:
+        return _render_segment(unit[0], ctx, verbose_mode)
+    return _render_segment_batch(unit, ctx, verbose_mode)
+
+
+def _group_contiguous(work: list[dict], per_process: int) -> list[list[dict]]:
+    """Split pending tasks into runs of at most `per_process` that sit
+    back-to-back on the routine timeline (a reused segment breaks a run)."""
+    units: list[list[dict]] = []
+    for task in work:
+        if units and len(units[-1]) < per_process:
+            prev = units[-1][-1]
+            if abs(prev['timeline_offset'] + prev['length'] - task['timeline_offset']) < 1e-6:
+                units[-1].append(task)
+                continue
+        units.append([task])
+    return units
+
+
 # --- Main Logic ---
 def assemble_video(
     config_path: str,
@@ -477,19 +856,23 @@ def assemble_video(
     source_end_limit: float | None = None,
     test_mode: bool = False,
     verbose_mode: bool = False,
-    force_render: bool = False
-):
+    force_render: bool = False,
+    num_workers: int | None = None,
+    nvenc_concurrency: int | None = None
+) -> dict:
+    """Renders and joins every segment; returns the parsed config for reuse."""
     total_start_time = time.monotonic()
 
     try:
-        with open(config_path, 'r', encoding='utf-8') as f: cfg = yaml.safe_load(f)
+        cfg = load_yaml(config_path)
     except FileNotFoundError:
         sys.exit(f"FATAL: Config file not found at '{config_path}'")
     try:
-        with open(routine_path, 'r', encoding='utf-8') as f: routine = yaml.safe_load(f)
+        routine = load_yaml(routine_path)
     except FileNotFoundError:
         sys.exit(f"FATAL: Routine file not found at '{routine_path}'")
-    if not os.path.exists(source_video_path):
+    source_video_stat = _stat(source_video_path)
+    if source_video_stat is None:
         sys.exit(f"FATAL: Source video not found at '{source_video_path}'")
 
     paths_cfg = cfg.get('paths', {})
@@ -507,15 +890,20 @@ def assemble_video(
             video_cfg.update(cfg.get('test_mode_settings'))
     if force_render:
         print("\n--- 💥 FORCED RE-RENDER ENABLED 💥 ---")
+        _probe_file_cached.cache_clear()
 
     # === Pre-bake LUT chain ONCE (cached) for the whole run ===
     apply_lut = source_cfg.get('apply_lut', False)
     lut_files_cfg = source_cfg.get('lut_files', []) or []
     effective_luts: list[str] = []
     if apply_lut and isinstance(lut_files_cfg, list) and lut_files_cfg:
-        existing_luts = [lf for lf in lut_files_cfg if os.path.exists(lf)]
-        for missing in [lf for lf in lut_files_cfg if not os.path.exists(lf)]:
-            print(f"  > WARNING: LUT file not found, skipping: {missing}")
+        # Validated once here; segments only ever see ctx['lut_filter'].
+        existing_luts = []
+        for lf in lut_files_cfg:
+            if _stat(lf):
+                existing_luts.append(lf)
+            else:
+                print(f"  > WARNING: LUT file not found, skipping: {lf}")
         if len(existing_luts) > 1:
             try:
                 from combine_luts import get_or_build_combined_lut
@@ -533,11 +921,24 @@ def assemble_video(
         print("  > INFO: Switching to HEVC codec for 10-bit output.")
         video_cfg['codec'] = 'hevc_nvenc'
 
+    # The LUT filter string is identical for every segment; build it once.
+    # Skip the BT.2020/HLG roundtrip the original code did -- a no-op for
+    # V-Log -> Rec.709 LUT chains and an expensive zscale pair.
+    lut_filter = ""
+    if effective_luts:
+        out_pix_fmt = 'p010le' if int(video_cfg.get('bit_depth', 8)) == 10 else 'yuv420p'
+        lut_filter = ",".join(
+            ["zscale=rin=tv:r=full"]
+            + [f"lut3d=file='{escape_filter_path(lf)}':interp=tetrahedral" for lf in effective_luts]
+            + [f"zscale=rin=full:r=limited,format={out_pix_fmt}"]
+        )
+
     ctx = {
         'cfg': cfg, 'paths_cfg': paths_cfg, 'video_cfg': video_cfg,
         'title_cfg': title_cfg, 'ring_cfg': ring_cfg, 'source_cfg': source_cfg,
         'finish_cfg': finish_cfg, 'sfx_cfg': sfx_cfg, 'bgm_cfg': bgm_cfg,
-        'effective_luts': effective_luts,
+        'effective_luts': effective_luts, 'lut_filter': lut_filter,
+        'lut_names': ", ".join(os.path.basename(lf) for lf in effective_luts),
     }
 
     print("--- 🏋️ Starting Video Assembly 🏋️ ---")
@@ -548,16 +949,26 @@ def assemble_video(
 
     # === PASS 1: Build task list (sequential, cheap) ===
     manifest = _load_manifest()
-    try:
-        source_video_mtime = os.path.getmtime(source_video_path)
-    except OSError:
-        source_video_mtime = 0
-    bgm_mtime = (os.path.getmtime(background_music_path)
-                 if background_music_path and os.path.exists(background_music_path) else 0)
+    source_video_mtime = source_video_stat.st_mtime
+    bgm_stat = _stat(background_music_path) if background_music_path else None
+    bgm_mtime = bgm_stat.st_mtime if bgm_stat else 0
 
     tasks: list[dict] = []
     routine_elapsed_time = 0.0
 
+    # One directory read for all timer assets instead of a stat per segment.
+    available_timers = _scan_timer_assets(os.path.join(
+        paths_cfg.get('asset_output_dir', '.'), paths_cfg.get('timers_subdir', 'timers')))
+
+    # Lowercase every SFX trigger once up front rather than per segment.
+    # (rule, has '*' wildcard, lowercased non-wildcard triggers), built once.
+    sfx_rules_prepped: list[tuple[dict, bool, tuple[str, ...]]] = []
+    if sfx_cfg.get('rules') and sfx_cfg.get('effects'):
+        for rule in sfx_cfg['rules']:
+            triggers = rule.get('triggers', [])
+            sfx_rules_prepped.append(
+                (rule, '*' in triggers, tuple(t.lower() for t in triggers if t != '*')))
+
     for i, exercise in enumerate(routine):
         segment_number = i + 1
         name = exercise.get('name', '...').title()
@@ -571,14 +982,14 @@ def assemble_video(
         start_time_in_source = source_start_offset + routine_elapsed_time
         end_time_in_source = start_time_in_source + length
 
-        output_segment_file = f"temp_segment_{i}.mp4"
+        output_segment_file = f"temp_segment_{i}.ts"
 
         if segments_to_process and segment_number not in segments_to_process:
             if verbose_mode:
                 print(f"\nSkipping Segment {segment_number}/{len(routine)}: '{name}'")
             # Still keep the existing temp in the concat list so the final
             # video isn't truncated when the user only re-renders a subset.
-            if os.path.exists(output_segment_file) and os.path.getsize(output_segment_file) > 0:
+            if _nonempty_file(output_segment_file):
                 tasks.append({'reuse': True, 'output': output_segment_file, 'i': i, 'name': name})
             routine_elapsed_time += length
             continue
@@ -593,8 +1004,10 @@ def assemble_video(
 
         replacement_video_path = exercise.get('replace_video')
         replacement_audio_path = exercise.get('replace_audio')
-        has_video_replacement = bool(replacement_video_path and os.path.exists(replacement_video_path))
-        has_audio_replacement = bool(replacement_audio_path and os.path.exists(replacement_audio_path))
+        replacement_video_stat = _stat(replacement_video_path) if replacement_video_path else None
+        replacement_audio_stat = _stat(replacement_audio_path) if replacement_audio_path else None
+        has_video_replacement = replacement_video_stat is not None
+        has_audio_replacement = replacement_audio_stat is not None
 
         final_video_input_path = replacement_video_path if has_video_replacement else source_video_path
         final_video_input_args = [] if has_video_replacement else [
@@ -603,17 +1016,10 @@ def assemble_video(
         final_audio_input_args = [] if has_audio_replacement else [
             '-ss', str(start_time_in_source), '-to', str(end_time_in_source)]
 
-        timer_duration = int(length)
-        timer_file = os.path.join(
-            paths_cfg.get('asset_output_dir', '.'),
-            paths_cfg.get('timers_subdir', 'timers'),
-            f'timer_{timer_duration}s.mov',
-        )
-        use_timer = os.path.exists(timer_file)
+        timer_file = available_timers.get(int(length))
+        use_timer = timer_file is not None
 
-        use_bgm = bool(background_music_path
-                       and os.path.exists(background_music_path)
-                       and bgm_cfg.get('enabled', False))
+        use_bgm = bool(bgm_stat and bgm_cfg.get('enabled', False))
         if not use_bgm and background_music_path and not bgm_cfg.get('enabled', False):
             # Print this once, on the first segment that would have used BGM.
             if i == 0:
@@ -624,18 +1030,17 @@ def assemble_video(
         # produce identical output regardless of parallel scheduling order).
         rng = random.Random(f"{source_video_path}|{i}|{name}")
         sfx_rule_to_apply = None
-        if sfx_cfg.get('rules') and sfx_cfg.get('effects'):
-            for rule in sfx_cfg['rules']:
-                if any(trigger == '*' or trigger.lower() in name.lower()
-                       for trigger in rule.get('triggers', [])):
-                    if rng.random() < rule.get('play_percent', 100) / 100.0:
-                        sfx_rule_to_apply = rule
-                        break
+        name_lc = name.lower()
+        for rule, wildcard, triggers in sfx_rules_prepped:
+            if wildcard or any(trigger in name_lc for trigger in triggers):
+                if rng.random() < rule.get('play_percent', 100) / 100.0:
+                    sfx_rule_to_apply = rule
+                    break
         sfx_delay_ms = 0
         if sfx_rule_to_apply:
             effect_details = sfx_cfg['effects'].get(sfx_rule_to_apply.get('effect'), {})
             sfx_path = effect_details.get('file')
-            if not (sfx_path and os.path.exists(sfx_path)):
+            if not (sfx_path and _stat(sfx_path)):
                 print(f"    - WARNING: Sound effect file not found for segment '{name}'. Skipping.")
                 sfx_rule_to_apply = None
             else:
@@ -652,10 +1057,11 @@ def assemble_video(
             'start': start_time_in_source, 'end': end_time_in_source,
             'src': os.path.abspath(source_video_path), 'src_mtime': source_video_mtime,
             'replace_v': replacement_video_path,
-            'replace_v_mtime': os.path.getmtime(replacement_video_path) if has_video_replacement else 0,
+            'replace_v_mtime': replacement_video_stat.st_mtime if has_video_replacement else 0,
             'replace_a': replacement_audio_path,
-            'replace_a_mtime': os.path.getmtime(replacement_audio_path) if has_audio_replacement else 0,
+            'replace_a_mtime': replacement_audio_stat.st_mtime if has_audio_replacement else 0,
             'timer_file': timer_file if use_timer else None,
+            'timeline_offset': routine_elapsed_time,
             'use_bgm': use_bgm, 'bgm_offset': bgm_offset,
             'bgm_path': os.path.abspath(background_music_path) if use_bgm else None,
             'bgm_mtime': bgm_mtime,
@@ -669,8 +1075,7 @@ def assemble_video(
 
         # Reuse via manifest (no ffprobe call) when fingerprint matches.
         if (not force_render
-                and os.path.exists(output_segment_file)
-                and os.path.getsize(output_segment_file) > 0
+                and _nonempty_file(output_segment_file)
                 and manifest.get(output_segment_file) == fingerprint):
             print(f"\nReusing Segment {segment_number}/{len(routine)}: '{name}' (manifest hit)")
             tasks.append({'reuse': True, 'output': output_segment_file, 'i': i, 'name': name})
@@ -694,6 +1099,7 @@ def assemble_video(
             'replaced_video': has_video_replacement,
             'replaced_audio': has_audio_replacement,
             'timer_file': timer_file, 'use_timer': use_timer,
+            'timeline_offset': routine_elapsed_time,
             'use_bgm': use_bgm, 'bgm_offset': bgm_offset,
             'background_music_path': background_music_path,
             'sfx_rule_to_apply': sfx_rule_to_apply,
@@ -705,30 +1111,46 @@ def assemble_video(
     # === PASS 2: Render in parallel ===
     work = [t for t in tasks if not t.get('reuse')]
     perf_cfg = cfg.get('performance', {})
-    num_workers = max(1, int(perf_cfg.get('num_workers', 1)))
+    num_workers = max(1, int(num_workers or perf_cfg.get('num_workers', 1)))
     if work:
-        effective_workers = min(num_workers, len(work))
+        # Contiguous pending segments can share one ffmpeg process (opt-in); each
+        # unit is one process, so worker and NVENC limits apply per unit.
+        per_process = max(1, int(perf_cfg.get('segments_per_process', 1)))
+        units = _group_contiguous(work, per_process)
+        effective_workers = min(num_workers, len(units))
+        nvenc_sessions = max(1, int(nvenc_concurrency or perf_cfg.get('nvenc_sessions') or effective_workers))
+        ctx['nvenc_gate'] = threading.BoundedSemaphore(nvenc_sessions)
+        # With NVENC, only nvenc_sessions processes run at once, so size threads for those.
+        concurrent = min(effective_workers, nvenc_sessions) if 'nvenc' in ctx['video_cfg']['codec'] else effective_workers
+        ctx['ffmpeg_threads'] = _ffmpeg_threads_per_invocation(concurrent)
         print(f"\n--- 🧵 Rendering {len(work)} segment(s) with {effective_workers} worker(s) in parallel ---")
+        if len(units) < len(work):
+            print(f"  > Batched into {len(units)} FFmpeg process(es) of up to {per_process} segment(s).")
+        if nvenc_sessions < effective_workers:
+            print(f"  > At most {nvenc_sessions} NVENC process(es) will run at once.")
+        if effective_workers > 1 and perf_cfg.get('prefetch_source', True):
+            _prefetch_source(source_video_path)
         if effective_workers <= 1:
-            for t in work:
-                lines = _render_segment(t, ctx, verbose_mode)
+            for unit in units:
+                lines = _render_unit(unit, ctx, verbose_mode)
                 for line in lines:
                     print(line)
         else:
-            failures: list[tuple[dict, Exception]] = []
+            failures: list[tuple[list[dict], Exception]] = []
             with ThreadPoolExecutor(max_workers=effective_workers) as ex:
-                future_to_task = {ex.submit(_render_segment, t, ctx, verbose_mode): t for t in work}
-                for fut in as_completed(future_to_task):
-                    t = future_to_task[fut]
+                future_to_unit = {ex.submit(_render_unit, unit, ctx, verbose_mode): unit for unit in units}
+                for fut in as_completed(future_to_unit):
+                    unit = future_to_unit[fut]
                     try:
                         lines = fut.result()
                         for line in lines:
                             print(line)
                     except Exception as e:
-                        failures.append((t, e))
+                        failures.append((unit, e))
             if failures:
-                for t, e in failures:
-                    print(f"\n--- FATAL: Segment '{t['name']}' failed: {e} ---")
+                for unit, e in failures:
+                    names = ", ".join(f"'{t['name']}'" for t in unit)
+                    print(f"\n--- FATAL: Segment(s) {names} failed: {e} ---")
                 sys.exit(1)
 
     segment_files = [t['output'] for t in tasks]
@@ -738,27 +1160,33 @@ def assemble_video(
     _prune_manifest(set(segment_files))
 
     if not segment_files: sys.exit("\nNo segments were created.")
-    if len(segment_files) == 1:
-        print("\n--- 🎞️ Finalizing Single Segment ---"); shutil.move(segment_files[0], output_path); print(f"  > Renamed '{segment_files[0]}' to '{output_path}'.")
-    else:
-        print(f"\n--- 🎞️ Concatenating {len(segment_files)} Segments ---")
-        concat_file = "concat_list.txt"
-        with open(concat_file, 'w', encoding='utf-8') as f:
-            for file in segment_files: f.write(f"file '{Path(file).resolve().as_posix()}'\n")
-        # Stream-copy both video and audio: every segment was encoded with identical
-        # codec/params so concat is lossless, and we avoid an AAC re-encode here
-        # (loudness normalization will do the only audio re-encode after this).
-        concat_cmd = [ 'ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', concat_file, '-c', 'copy', output_path ]
-        if verbose_mode: print("    - Running concat command:", " ".join(concat_cmd))
-        try:
-            subprocess.run(concat_cmd, check=True, capture_output=not verbose_mode, text=True, encoding='utf-8')
-            print("  > Concatenation finished successfully.")
-        except subprocess.CalledProcessError as e:
-            if not verbose_mode:
-                print("  > FFmpeg error output (stderr):", e.stderr)
-            sys.exit(1)
-        finally:
-            if os.path.exists(concat_file): os.remove(concat_file)
+    print(f"\n--- 🎞️ Joining {len(segment_files)} Segment(s) ---")
+    # The concat demuxer rebases each segment onto the end of the previous one,
+    # so the joined timeline has no holes even when --segments leaves some
+    # segments without a temp file (their -output_ts_offset assumed they'd be
+    # there). Stream-copy both video and audio (loudness normalization will do
+    # the only audio re-encode after this).
+    # +faststart rewrites the whole file, so only do it here when no
+    # normalization pass is going to rewrite the output again.
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as f:
+        for file in segment_files:
+            quoted = Path(file).resolve().as_posix().replace("'", "'\\''")
+            f.write(f"file '{quoted}'\n")
+        concat_list_path = f.name
+    concat_cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', concat_list_path, '-c', 'copy']
+    if not _loudness_normalization_enabled(cfg):
+        concat_cmd += ['-movflags', '+faststart']
+    concat_cmd.append(output_path)
+    if verbose_mode: print("    - Running concat command:", " ".join(concat_cmd))
+    try:
+        run_ffmpeg(concat_cmd, verbose_mode)
+        print("  > Concatenation finished successfully.")
+    except subprocess.CalledProcessError as e:
+        if not verbose_mode:
+            print("  > FFmpeg error output (stderr):", e.stderr)
+        sys.exit(1)
+    finally:
+        os.remove(concat_list_path)
 
     print("\n--- 🧹 Cleaning Up Temporary Files ---")
     # Only delete temps that were freshly rendered this run. Reused temps must
@@ -770,6 +1198,7 @@ def assemble_video(
             os.remove(file)
     print(f"\n✅ Video assembly complete! Final video saved to: {output_path}")
     print(f"   Total time taken: {time.monotonic() - total_start_time:.2f} seconds.")
+    return cfg
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser( description="Creates a complete exercise video from a source file and a routine plan.", formatter_class=argparse.ArgumentDefaultsHelpFormatter )
@@ -784,11 +1213,13 @@ if __name__ == '__main__':
     parser.add_argument("--force-render", action="store_true", help="Force re-rendering of all segments, ignoring existing temp files.")
     parser.add_argument("--verbose", "-v", action="store_true", help="Show the full FFmpeg command and its real-time output.")
     parser.add_argument("--config", type=str, default='config.yaml', help="Path to config file.")
+    parser.add_argument("--segment-workers", type=int, help="Segments to render in parallel. Overrides performance.num_workers.")
+    parser.add_argument("--nvenc-concurrency", type=int, help="Max NVENC ffmpeg processes running at once (decode, filters and encode). Overrides performance.nvenc_sessions.")
     args = parser.parse_args()
 
     segments_to_run = [int(s.strip()) for s in args.segments.split(',')] if args.segments else None
 
-    assemble_video(
+    cfg = assemble_video(
         config_path=args.config,
         routine_path=args.routine_path,
         source_video_path=args.source_video,
@@ -799,11 +1230,14 @@ if __name__ == '__main__':
         source_end_limit=args.end,
         test_mode=args.test,
         verbose_mode=args.verbose,
-        force_render=args.force_render
+        force_render=args.force_render,
+        num_workers=args.segment_workers,
+        nvenc_concurrency=args.nvenc_concurrency
     )
 
     optimize_final_audio(
         config_path=args.config,
         video_file_path=args.output_video,
-        verbose=args.verbose
+        verbose=args.verbose,
+        cfg=cfg
     )
\ No newline at end of file
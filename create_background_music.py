@@ -6,67 +6,174 @@ import subprocess
 import argparse
 from pathlib import Path
 import math
+import json
+import hashlib
+import atexit
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as YamlLoader
+
+try:
+    import mutagen  # reads durations from the file header, no subprocess
+except ImportError:
+    mutagen = None
 
 # A small cache to avoid repeated ffprobe calls for the same file
 DURATION_CACHE = {}
+# On-disk copy of probed durations, reused across runs while a file's size and
+# mtime are unchanged: {abs_path: [size, mtime_ns, duration]}
+DURATION_STORE_PATH = os.path.join('.cache', 'durations.json')
+# Sidecar next to the output that remembers the planned timeline between runs
+PLAN_SUFFIX = '.plan.json'
+
+def _load_duration_store():
+    try:
+        with open(DURATION_STORE_PATH, 'r', encoding='utf-8') as f: return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError, OSError):
+        return {}
+
+_duration_store = _load_duration_store()
+_duration_store_dirty = False
+
+@atexit.register
+def _save_duration_store():
+    if not _duration_store_dirty: return
+    try:
+        os.makedirs(os.path.dirname(DURATION_STORE_PATH), exist_ok=True)
+        tmp_path = DURATION_STORE_PATH + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(_duration_store, f)
+        os.replace(tmp_path, DURATION_STORE_PATH)
+    except OSError as e:
+        print(f"Warning: Could not save duration cache: {e}")
+
+def _header_duration(path):
+    """Duration from the container header via mutagen, or None to fall back to ffprobe."""
+    if mutagen is None: return None
+    try:
+        info = mutagen.File(path)
+    except Exception:
+        return None
+    length = getattr(getattr(info, 'info', None), 'length', None)
+    return float(length) if length and length > 0 else None
 
 def get_audio_duration(file_path):
     """Returns the duration of an audio file in seconds, with caching."""
+    global _duration_store_dirty
     if not file_path: return 0
     abs_path = os.path.abspath(file_path)
     if abs_path in DURATION_CACHE:
         return DURATION_CACHE[abs_path]
 
+    try:
+        st = os.stat(abs_path)
+        stamp = [st.st_size, st.st_mtime_ns]
+    except OSError:
+        stamp = None
+    stored = _duration_store.get(abs_path)
+    if stamp and stored and stored[:2] == stamp:
+        DURATION_CACHE[abs_path] = stored[2]
+        return stored[2]
+
+    duration = _header_duration(abs_path)
     cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', str(file_path)]
     try:
-        duration_str = subprocess.check_output(cmd, text=True, encoding='utf-8').strip()
-        duration = float(duration_str)
+        if duration is None:
+            duration_str = subprocess.check_output(cmd, text=True, encoding='utf-8', stdin=subprocess.DEVNULL).strip()
+            duration = float(duration_str)
         DURATION_CACHE[abs_path] = duration
+        if stamp:
+            _duration_store[abs_path] = stamp + [duration]
+            _duration_store_dirty = True
         return duration
     except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
         print(f"Warning: Could not get duration for '{file_path}': {e}")
         return 0
 
-def scan_and_shuffle(folder_path):
+def prefetch_durations(files):
+    """Probes every not-yet-cached track in parallel so timeline planning only hits DURATION_CACHE."""
+    pending = {os.path.abspath(f): f for f in files}
+    pending = [f for abs_path, f in pending.items() if abs_path not in DURATION_CACHE]
+    if not pending: return
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as pool:
+        list(pool.map(get_audio_duration, pending))
+
+MUSIC_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a')
+
+def _walk_music(dir_path):
+    """Recursively collects music file paths under `dir_path` with os.scandir."""
+    found, subdirs = [], []
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(MUSIC_EXTENSIONS) and entry.is_file():
+                    found.append(entry.path)
+    except OSError:
+        return found
+    for sub in subdirs:
+        found.extend(_walk_music(sub))
+    return found
+
+def scan_and_shuffle(folder_path, rng=random):
     """Scans a folder recursively for music and returns a shuffled deque and the source list."""
     if not folder_path or not folder_path.is_dir():
         return deque(), []
-    files = [p for p in folder_path.rglob('*') if p.is_file() and p.suffix.lower() in ['.mp3', '.wav', '.flac', '.m4a']]
-    random.shuffle(files)
+    # Walk each top-level subfolder on its own thread; on network or cold-cache
+    # libraries the walk is dominated by directory-read latency, not CPU.
+    top_files, top_dirs = [], []
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                top_dirs.append(entry.path)
+            elif entry.name.lower().endswith(MUSIC_EXTENSIONS) and entry.is_file():
+                top_files.append(entry.path)
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        for sub_files in pool.map(_walk_music, top_dirs):
+            top_files.extend(sub_files)
+    # Sort before shuffling so the seeded shuffle doesn't depend on directory order.
+    files = sorted(Path(p) for p in top_files)
+    rng.shuffle(files)
     return deque(files), files
 
-def create_background_music(
-    routine_path: str,
-    output_path_str: str,
-    config_path: str = 'config.yaml',
-    verbose_mode: bool = False
-):
-    output_path = Path(output_path_str)
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f: cfg = yaml.safe_load(f)
-    except FileNotFoundError: sys.exit(f"FATAL: Config file not found at '{config_path}'")
-    try:
-        with open(routine_path, 'r', encoding='utf-8') as f: routine = yaml.safe_load(f)
-    except FileNotFoundError: sys.exit(f"FATAL: Routine file not found at '{routine_path}'")
+def _plan_key(routine, bgm_cfg):
+    """Stable hash over everything that shapes the planned timeline."""
+    blob = json.dumps({'routine': routine, 'bgm': bgm_cfg}, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(blob).hexdigest()
 
-    bgm_cfg = cfg.get('background_music', {})
-    if not bgm_cfg.get('enabled', False):
-        print("Background music is disabled. Exiting.")
-        return
+def _input_stamps(files):
+    """Maps each input track to its mtime so edited/replaced files invalidate the saved encode."""
+    return {str(f): os.path.getmtime(f) for f in files}
 
-    total_duration = sum(float(ex.get('length', 0)) for ex in routine)
-    if total_duration <= 0: sys.exit("Routine has zero duration.")
-    
-    crossfade_duration = float(bgm_cfg.get('crossfade_duration', 0.0))
+def load_plan(plan_path, key):
+    """Returns the saved plan if it matches `key` and all its tracks still exist, else None."""
+    try:
+        with open(plan_path, 'r', encoding='utf-8') as f: plan = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError, OSError):
+        return None
+    if plan.get('key') != key: return None
+    blocks = []
+    for block in plan.get('blocks', []):
+        if block.get('file') is not None:
+            if not os.path.exists(block['file']): return None
+            block = {**block, 'file': Path(block['file'])}
+        blocks.append(block)
+    plan['blocks'] = blocks
+    return plan
 
-    print(f"--- Creating Continuous Background Music ---")
-    print(f"  > Total duration: {total_duration:.2f}s.")
-    if crossfade_duration > 0: print(f"  > Crossfades enabled ({crossfade_duration}s).")
+def save_plan(plan_path, key, seed, song_blocks, ffmpeg_cmd, unique_files):
+    blocks = [{**b, 'file': str(b['file']) if b.get('file') is not None else None} for b in song_blocks]
+    plan = {'key': key, 'seed': seed, 'blocks': blocks, 'cmd': ffmpeg_cmd, 'inputs': _input_stamps(unique_files)}
+    with open(plan_path, 'w', encoding='utf-8') as f: json.dump(plan, f, indent=2)
 
+def plan_song_blocks(routine, bgm_cfg, rng):
+    """Lays out the "radio mix" timeline for the routine as a list of song blocks."""
     # --- 1. Prepare Music Libraries ---
     main_music_folder = Path(bgm_cfg.get('music_folder', 'assets/music'))
-    global_playlist_deque, global_source_files = scan_and_shuffle(main_music_folder)
+    global_playlist_deque, global_source_files = scan_and_shuffle(main_music_folder, rng)
     
     rules = bgm_cfg.get('rules', [])
     rule_playlists = {}
@@ -77,15 +184,32 @@ def create_background_music(
         if 'folder' in rule:
             folder_path = Path(rule['folder'])
             if folder_path.is_dir():
-                d, s = scan_and_shuffle(folder_path)
+                d, s = scan_and_shuffle(folder_path, rng)
                 rule_playlists[rule['folder']] = {'deque': d, 'source_files': s}
                 print(f"    - Rule '{rule.get('name')}': Found {len(s)} tracks in '{folder_path}'.")
 
+    # Lowercase triggers and drop rules whose music is missing once, up front,
+    # instead of re-checking every rule for every segment.
+    rules_prepped = [
+        (r, tuple(t.lower() for t in r.get('triggers', [])))
+        for r in rules
+        if Path(r.get('file', '')).exists() or r.get('folder') in rule_playlists
+    ]
+
+    # ffprobe is mostly process start-up and I/O wait; probe the whole library
+    # concurrently rather than one track at a time as the planner reaches it.
+    prefetch_durations(
+        global_source_files
+        + [f for data in rule_playlists.values() for f in data['source_files']]
+        + [Path(r['file']) for r, _ in rules_prepped if 'file' in r]
+    )
+
     # --- 2. Build High-Level "Song Block" Timeline ---
     song_blocks = []
     
     active_track = None
     active_track_played = 0.0
+    active_track_dur = 0.0
     
     active_playlist_deque = global_playlist_deque
     active_source_files = global_source_files
@@ -101,7 +225,8 @@ def create_background_music(
         ex_name = exercise.get('name', '')
         
         # Check for rules and determine if an interruption is needed
-        matched_rule = next((r for r in rules if any(t.lower() in ex_name.lower() for t in r.get('triggers',[])) and (Path(r.get('file','')).exists() or r.get('folder') in rule_playlists)), None)
+        ex_name_lc = ex_name.lower()
+        matched_rule = next((r for r, trigs in rules_prepped if any(t in ex_name_lc for t in trigs)), None)
         
         interruption_forced = False
         
@@ -134,6 +259,7 @@ def create_background_music(
                 if active_track != rule_file:
                     print(f"    - Segment {i+1} ('{ex_name}'): Rule forces new track '{rule_file.name}'.")
                     active_track = rule_file; active_track_played = 0.0
+                    active_track_dur = get_audio_duration(rule_file)
                     interruption_forced = True
                     active_playlist_deque = global_playlist_deque
                     active_source_files = global_source_files
@@ -158,7 +284,7 @@ def create_background_music(
             if not (matched_rule and 'file' in matched_rule): active_track = None
 
         while time_left_in_seg > 0.001:
-            if active_track is None or active_track_played >= get_audio_duration(active_track):
+            if active_track is None or active_track_played >= active_track_dur:
                 if current_block: song_blocks.append(current_block)
                 current_block = None
 
@@ -167,16 +293,17 @@ def create_background_music(
                         song_blocks.append({'file': None, 'duration': time_left_in_seg})
                         break
                     print(f"    - Playlist exhausted. Reshuffling {len(active_source_files)} tracks...")
-                    random.shuffle(active_source_files)
+                    rng.shuffle(active_source_files)
                     active_playlist_deque.extend(active_source_files)
                 
                 active_track = active_playlist_deque.popleft(); active_track_played = 0.0
+                active_track_dur = get_audio_duration(active_track)
                 print(f"    - Starting new track: '{active_track.name}'")
 
             if not current_block:
                 current_block = {'file': active_track, 'start': active_track_played, 'duration': 0}
 
-            track_rem = get_audio_duration(active_track) - (current_block['start'] + current_block['duration'])
+            track_rem = active_track_dur - (current_block['start'] + current_block['duration'])
             play_dur = min(time_left_in_seg, track_rem)
             
             current_block['duration'] += play_dur; active_track_played += play_dur
@@ -185,35 +312,106 @@ def create_background_music(
         previous_rule = matched_rule # Update previous rule at the end of the segment logic
 
     if current_block: song_blocks.append(current_block)
+    return song_blocks
+
+def merge_adjacent_blocks(song_blocks):
+    """Collapses back-to-back blocks that continue the same track (or silence) into one block."""
+    merged = []
+    for block in song_blocks:
+        prev = merged[-1] if merged else None
+        if prev and prev.get('mode') != 'loop' and block.get('mode') != 'loop' and prev.get('file') == block.get('file'):
+            if block.get('file') is None or abs(prev['start'] + prev['duration'] - block['start']) < 0.001:
+                merged[-1] = {**prev, 'duration': prev['duration'] + block['duration']}
+                continue
+        merged.append(block)
+    return merged
+
+def create_background_music(
+    routine_path: str,
+    output_path_str: str,
+    config_path: str = 'config.yaml',
+    verbose_mode: bool = False,
+    seed: int = None
+):
+    output_path = Path(output_path_str)
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f: cfg = yaml.load(f, Loader=YamlLoader)
+    except FileNotFoundError: sys.exit(f"FATAL: Config file not found at '{config_path}'")
+    try:
+        with open(routine_path, 'r', encoding='utf-8') as f: routine = yaml.load(f, Loader=YamlLoader)
+    except FileNotFoundError: sys.exit(f"FATAL: Routine file not found at '{routine_path}'")
+
+    bgm_cfg = cfg.get('background_music', {})
+    if not bgm_cfg.get('enabled', False):
+        print("Background music is disabled. Exiting.")
+        return
+
+    total_duration = sum(float(ex.get('length', 0)) for ex in routine)
+    if total_duration <= 0: sys.exit("Routine has zero duration.")
+    
+    crossfade_duration = float(bgm_cfg.get('crossfade_duration', 0.0))
+
+    print(f"--- Creating Continuous Background Music ---")
+    print(f"  > Total duration: {total_duration:.2f}s.")
+    if crossfade_duration > 0: print(f"  > Crossfades enabled ({crossfade_duration}s).")
+
+    plan_path = output_path.with_name(output_path.name + PLAN_SUFFIX)
+    plan_key = _plan_key(routine, bgm_cfg)
+    saved_plan = load_plan(plan_path, plan_key)
+    if saved_plan and seed is not None and saved_plan.get('seed') != seed:
+        saved_plan = None
+    if saved_plan:
+        # Same routine and music rules as last time: keep the earlier picks so the
+        # track (and every segment fingerprint that depends on it) stays stable.
+        print(f"\n  > Reusing saved audio timeline from '{plan_path.name}'.")
+        song_blocks = saved_plan['blocks']
+        seed = saved_plan.get('seed')
+    else:
+        # A fresh plan gets a fresh seed; it's stored in the sidecar so the picks can be replayed with --seed.
+        if seed is None: seed = random.SystemRandom().getrandbits(64)
+        print(f"\n  > Planning a new audio timeline (seed {seed}).")
+        rng = random.Random(seed)
+        song_blocks = plan_song_blocks(routine, bgm_cfg, rng)
 
     # --- 3. Build FFmpeg command from the song blocks ---
     ffmpeg_cmd = ['ffmpeg', '-y']
     filter_complex = []
     
-    unique_files = sorted(list(set(b['file'] for b in song_blocks if b.get('file'))))
-    file_to_idx = {file: i for i, file in enumerate(unique_files)}
-    for file in unique_files: ffmpeg_cmd.extend(['-i', str(file)])
+    # First-use order: these only feed the mtime stamps, so there's nothing to sort for.
+    unique_files = list(dict.fromkeys(b['file'] for b in song_blocks if b.get('file')))
         
     print("\n  > Building FFmpeg filtergraph...")
-    
-    for i, block in enumerate(song_blocks):
+    # A track that carries on across segments is one trim, not a chain of trim+concat pairs.
+    graph_blocks = merge_adjacent_blocks(song_blocks)
+
+    # Each played slice gets its own input seeked with -ss/-t, so ffmpeg jumps
+    # straight to the slice instead of decoding the track from the top and
+    # discarding everything before it. Only looped files are opened whole,
+    # once per file.
+    file_to_idx = {}; num_inputs = 0
+    for i, block in enumerate(graph_blocks):
         s_name = f"[b{i}]"
         if block.get('file') is None:
             filter_complex.append(f"anullsrc=r=48000:cl=stereo,atrim=duration={block['duration']}{s_name}")
             continue
             
-        idx=file_to_idx[block['file']]; dur=get_audio_duration(block['file'])
         if block.get('mode') == 'loop':
+            if block['file'] not in file_to_idx:
+                file_to_idx[block['file']] = num_inputs; num_inputs += 1
+                ffmpeg_cmd.extend(['-i', str(block['file'])])
+            idx=file_to_idx[block['file']]; dur=get_audio_duration(block['file'])
             loops = math.ceil(block['duration']/dur) - 1 if dur > 0 else 0
             chain = f"[{idx}:a]aloop=loop={loops if loops >= 0 else 0}:size={int(dur*48000)},atrim=duration={block['duration']:.3f},asetpts=PTS-STARTPTS{s_name}"
         else:
-            chain = f"[{idx}:a]atrim=start={block['start']:.3f}:duration={block['duration']:.3f},asetpts=PTS-STARTPTS{s_name}"
+            idx = num_inputs; num_inputs += 1
+            ffmpeg_cmd.extend(['-ss', f"{block['start']:.3f}", '-t', f"{block['duration']:.3f}", '-i', str(block['file'])])
+            chain = f"[{idx}:a]asetpts=PTS-STARTPTS{s_name}"
         filter_complex.append(chain)
 
     last_chain = "[b0]"
     num_crossfades = 0
-    for i in range(1, len(song_blocks)):
-        prev_b = song_blocks[i-1]; curr_b = song_blocks[i]
+    for i in range(1, len(graph_blocks)):
+        prev_b = graph_blocks[i-1]; curr_b = graph_blocks[i]
         out_name = f"[c{i}]"
 
         should_crossfade = (
@@ -256,10 +454,16 @@ def create_background_music(
     ffmpeg_cmd.append(str(output_path))
     
     if verbose_mode: print("\n  > Assembled FFmpeg command:", ' '.join(f"'{c}'" for c in ffmpeg_cmd))
+
+    if (saved_plan and output_path.exists() and saved_plan.get('cmd') == ffmpeg_cmd
+            and saved_plan.get('inputs') == _input_stamps(unique_files)):
+        print(f"\n✅ Background music unchanged, keeping existing file: {output_path}")
+        return
         
     print("\n  > Encoding final audio file...")
     try:
         subprocess.run(ffmpeg_cmd, check=True, capture_output=not verbose_mode, text=True, encoding='utf-8')
+        save_plan(plan_path, plan_key, seed, song_blocks, ffmpeg_cmd, unique_files)
         print(f"\n✅ Background music created successfully: {output_path}")
     except subprocess.CalledProcessError as e:
         print("\n--- FATAL: FFmpeg failed. ---")
@@ -272,9 +476,10 @@ if __name__ == '__main__':
     parser.add_argument("output_file", help="Path for the final audio file.")
     parser.add_argument("--config", default="config.yaml", help="Path to config file.")
     parser.add_argument("-v", "--verbose", action="store_true", help="Show the full FFmpeg command.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the track picks. Replans if it differs from the saved plan's seed; a random seed is used when omitted.")
     
     args = parser.parse_args()
     create_background_music(
         routine_path=args.routine_path, output_path_str=args.output_file,
-        config_path=args.config, verbose_mode=args.verbose
+        config_path=args.config, verbose_mode=args.verbose, seed=args.seed
     )
\ No newline at end of file
@@ -2,44 +2,40 @@ import subprocess
 import os
 import argparse
 import sys
-import operator
-import tempfile
 import shlex
-import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 try:
     import yaml
+    try:
+        from yaml import CSafeLoader as YamlLoader
+    except ImportError:  # PyYAML built without libyaml
+        from yaml import SafeLoader as YamlLoader
 except ImportError:
     print("[ERROR] The 'PyYAML' library is required for the new routine-based analysis.")
     print("Please install it by running: pip install PyYAML")
     sys.exit(1)
 
-def get_video_pix_fmt(input_file):
-    """
-    Uses ffprobe to get the pixel format of the first video stream.
-    """
-    print("[INFO] Detecting video pixel format...")
-    command = [
-        "ffprobe",
-        "-v", "quiet",
-        "-print_format", "json",
-        "-show_streams",
-        input_file
-    ]
-    try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
-        video_stream = next((stream for stream in data['streams'] if stream['codec_type'] == 'video'), None)
-        if video_stream and 'pix_fmt' in video_stream:
-            pix_fmt = video_stream['pix_fmt']
-            print(f"[SUCCESS] Detected pixel format: {pix_fmt}")
-            return pix_fmt
-        else:
-            print("[WARNING] Could not determine pixel format. Defaulting to 'yuv420p'.")
-            return 'yuv420p' # A safe default
-    except (subprocess.CalledProcessError, FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"[WARNING] ffprobe failed to run or parse output: {e}. Defaulting to 'yuv420p'.")
-        return 'yuv420p' # A safe default
+try:
+    import numpy as np
+except ImportError:
+    print("[ERROR] The 'numpy' library is required for parsing the analysis log.")
+    print("Please install it by running: pip install numpy")
+    sys.exit(1)
+
+# metadata=print writes a "frame:N pts:P pts_time:T" line followed by the frame's
+# "lavfi.scene_score=S" line.
+SCENE_LOG_RE = re.compile(rb'pts_time:([-+.\deE]+)[^\n]*\n\s*lavfi\.scene_score=([-+.\deE]+)')
+# Prefix for ffmpeg runs whose stderr is captured or shared: no banner and no
+# per-frame progress lines, so only warnings and errors are buffered.
+FFMPEG_QUIET = ("ffmpeg", "-y", "-hide_banner", "-nostats")
+# Parallel analysis never splits the source into shards shorter than this.
+MIN_SHARD_SECONDS = 60.0
+# Each shard after the first starts decoding this early so the scene filter has
+# a previous frame to compare its first frame against.
+SHARD_PREROLL_SECONDS = 0.5
 
 def check_ffmpeg():
     """Checks if FFmpeg is installed and in the system's PATH."""
@@ -51,9 +47,62 @@ def check_ffmpeg():
         print("ERROR: FFmpeg is not installed or not in your system's PATH.")
         return False
 
-def analyze_video(input_file, threshold, use_gpu=False, cl_device="0.0", start_time=0.0, end_time=None, center_focus=None):
+def encoder_works(encoder, cuda_device="0"):
+    """
+    Encodes one tiny test frame with `encoder`. Catches both encoders missing from the
+    FFmpeg build and hardware encoders whose driver/device is unavailable at runtime.
+    """
+    command = [*FFMPEG_QUIET, "-loglevel", "error", "-f", "lavfi", "-i", "color=c=white:s=256x256:d=0.1",
+               "-frames:v", "1", "-c:v", encoder]
+    if 'nvenc' in encoder: command.extend(["-gpu", str(cuda_device)])
+    command.extend(["-f", "null", "-"])
+    try:
+        subprocess.run(command, capture_output=True, check=True, stdin=subprocess.DEVNULL)
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return False
+
+def get_video_duration(input_file):
+    """Returns the container duration in seconds, or None if ffprobe can't tell."""
+    command = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", input_file]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, check=True, stdin=subprocess.DEVNULL)
+        return float(result.stdout.strip())
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
+        return None
+
+def stream_scene_scores(command, log):
+    """
+    Runs an analysis command and parses (pts_time, scene_score) pairs from its stdout as
+    they arrive, copying the raw output to `log` when one is given.
+    """
+    pairs = []
+    with subprocess.Popen(command, stdout=subprocess.PIPE) as proc:
+        pending = b""
+        for chunk in iter(lambda: proc.stdout.read1(65536), b""):
+            if log is not None: log.write(chunk)
+            pending += chunk
+            # Only parse whole lines so a number split across reads is never matched short.
+            complete = pending.rfind(b"\n") + 1
+            consumed = 0
+            for match in SCENE_LOG_RE.finditer(pending, 0, complete):
+                pairs.append(match.groups())
+                consumed = match.end()
+            # Carry over the unfinished tail, starting at its frame record if it has one.
+            frame_start = pending.rfind(b"frame:", consumed)
+            pending = pending[frame_start if frame_start >= 0 else complete:]
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command)
+    return pairs
+
+def analyze_video(input_file, threshold, use_gpu=False, start_time=0.0, end_time=None, center_focus=None,
+                  log_file="scene_scores_temp.log", jobs=1):
     """
     Analyzes the video file, optionally cropping to the center for motion detection.
+    Scene scores are parsed as FFmpeg emits them and also saved to `log_file` so a
+    later run can skip this phase. With `jobs` > 1 a long span is split into shards
+    analyzed by concurrent FFmpeg processes. Returns (timestamps, scores) arrays, or
+    None on failure.
     """
     print(f"\n--- PHASE 1: ANALYZING VIDEO FOR MOTION ---")
     if start_time > 0.0 or end_time is not None:
@@ -71,109 +120,175 @@ def analyze_video(input_file, threshold, use_gpu=False, cl_device="0.0", start_t
 
 
     if use_gpu:
-        print(f"Using GPU acceleration for analysis (OpenCL on device {cl_device})")
-        source_pix_fmt = get_video_pix_fmt(input_file)
-        hwdownload_format = source_pix_fmt
-
-        if hwdownload_format == 'yuv420p10le':
-            hwdownload_format = 'p010le'
-            print(f"[INFO] Adjusted pixel format to '{hwdownload_format}' for hwdownload compatibility.")
-
-        print(f"[INFO] Using format '{hwdownload_format}' for GPU->CPU transfer.")
+        # The GPU decodes; the small crop/scale/scene chain stays on the CPU. Frames
+        # used to be uploaded to OpenCL and immediately downloaded again with no GPU
+        # filter in between, which only added two bus transfers per frame.
+        print(f"Using GPU hardware decoding for analysis")
     else:
         print(f"Using CPU for analysis")
 
-    log_filename = "scene_scores_temp.log"
+    # Scores go to ffmpeg's stdout (the null muxer doesn't use it) and are parsed
+    # while the analysis runs; `direct=1` stops the filter from buffering them.
+    metadata_sink = "metadata=print:file=pipe\\:1:direct=1"
+    if end_time is not None and end_time <= start_time:
+        print("[ERROR] End time must be greater than start time.")
+        return None
+
+    # Decimate to 15 fps first so crop and scale only touch the frames the scene
+    # filter will actually see (a quarter of them on 60 fps sources).
+    filter_chain = f"fps=15,{crop_filter_str}scale=w=320:h=240,select='gt(scene,{threshold})',{metadata_sink}"
+
+    # Scene scoring runs in one single-threaded filter graph per process, so long
+    # spans are split into time shards analyzed side by side.
+    shards = []
+    if jobs > 1:
+        span_end = end_time if end_time is not None else get_video_duration(input_file)
+        if span_end is not None and span_end > start_time:
+            num_shards = min(jobs, int((span_end - start_time) // MIN_SHARD_SECONDS))
+            if num_shards > 1:
+                bounds = np.linspace(start_time, span_end, num_shards + 1)
+                shards = list(zip(bounds[:-1], bounds[1:]))
+
+    if shards:
+        return _analyze_shards(input_file, filter_chain, use_gpu, shards, log_file)
+
+    # -copyts keeps pts_time on the source timeline so the clip start times can
+    # be used directly as seek positions during extraction.
     command = ["ffmpeg", "-y"]
-
     if start_time > 0.0:
         command.extend(["-ss", str(start_time)])
     if use_gpu:
-        command.extend(["-init_hw_device", f"opencl=ocl:{cl_device}"])
-    if start_time > 0.0 and end_time is not None:
+        command.extend(["-hwaccel", "auto"])
+    if start_time > 0.0:
         command.extend(["-copyts"])
     command.extend(["-i", input_file])
     if end_time is not None:
-        if end_time <= start_time:
-            print("[ERROR] End time must be greater than start time.")
-            return False
         command.extend(["-to", str(end_time)])
-
-    if use_gpu:
-        filter_chain = (
-            f"hwupload,"
-            f"hwdownload,format={hwdownload_format},"
-            f"{crop_filter_str}" # Crop is a CPU filter, so it goes after hwdownload
-            f"scale=w=320:h=240,"
-            f"fps=15,select='gt(scene,{threshold})',metadata=print:file={log_filename}"
-        )
-        command.extend(["-filter_hw_device", "ocl", "-vf", filter_chain])
-    else:
-        # Standard CPU-only filter chain
-        filter_chain = f"{crop_filter_str}scale=w=320:h=240,fps=15,select='gt(scene,{threshold})',metadata=print:file={log_filename}"
-        command.extend(["-vf", filter_chain])
-
+    command.extend(["-vf", filter_chain])
     command.extend(["-f", "null", "-"])
+    partial_log = log_file + ".part"
     try:
         print("\n[INFO] Starting FFmpeg scene analysis. See live progress below:")
         print("----------------------------------------------------------------------")
-        # The 'stderr=subprocess.PIPE' argument has been removed to allow live output.
-        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        # stderr is not captured so FFmpeg's live progress stays visible.
+        with open(partial_log, "wb") as log:
+            pairs = stream_scene_scores(command, log)
+        # Only a complete log is kept for resuming; a failed run leaves no stale log behind.
+        os.replace(partial_log, log_file)
         print("\n----------------------------------------------------------------------")
         print("[SUCCESS] FFmpeg analysis complete.")
-        return True
+        return scene_arrays(pairs)
     except subprocess.CalledProcessError as e:
         # Since stderr was not captured, it has already been printed to the screen.
         # We now print a simpler error message.
         full_command_str = ' '.join(shlex.quote(c) for c in command)
         print(f"\n[ERROR] FFmpeg analysis failed. See the error message above.")
         print(f"Full Command: {full_command_str}")
-        return False
+        return None
     except KeyboardInterrupt:
         print("\n\n[INFO] Process cancelled by user.")
-        return False
-
-def find_most_active_clips(log_file, clip_duration_sec, num_clips, scoring_method='sum'):
+        return None
+    finally:
+        # Gone already after a successful os.replace; otherwise it's a partial log.
+        try:
+            os.remove(partial_log)
+        except FileNotFoundError:
+            pass
+
+def _analyze_shards(input_file, filter_chain, use_gpu, shards, log_file):
+    """Analyzes each (start, end) shard in its own FFmpeg process and merges the scores in time order."""
+    def run_shard(bounds):
+        shard_start, shard_end = bounds
+        seek = max(0.0, shard_start - SHARD_PREROLL_SECONDS) if shard_start > shards[0][0] else shard_start
+        command = [*FFMPEG_QUIET, "-loglevel", "error"]
+        if seek > 0.0:
+            command.extend(["-ss", str(seek)])
+        if use_gpu:
+            command.extend(["-hwaccel", "auto"])
+        command.extend(["-copyts", "-t", str(shard_end - seek), "-i", input_file])
+        command.extend(["-vf", filter_chain, "-f", "null", "-"])
+        timestamps, scores = scene_arrays(stream_scene_scores(command, None))
+        # Drop the pre-roll and anything past the boundary; the neighbouring shard owns those frames.
+        keep = (timestamps >= shard_start) & ((timestamps < shard_end) | (shard_end == shards[-1][1]))
+        print(f"[INFO] Analyzed {shard_start:.1f}s-{shard_end:.1f}s.")
+        return timestamps[keep], scores[keep]
+
+    print(f"\n[INFO] Starting FFmpeg scene analysis in {len(shards)} parallel shards...")
+    try:
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            results = list(pool.map(run_shard, shards))
+    except subprocess.CalledProcessError as e:
+        print(f"\n[ERROR] FFmpeg analysis failed. See the error message above.")
+        print(f"Full Command: {' '.join(shlex.quote(c) for c in e.cmd)}")
+        return None
+    except KeyboardInterrupt:
+        print("\n\n[INFO] Process cancelled by user.")
+        return None
+
+    timestamps = np.concatenate([t for t, _ in results])
+    scores = np.concatenate([s for _, s in results])
+    # Shards overlap by their pre-roll, so the log is rebuilt from the merged scores
+    # instead of concatenating raw output that would repeat frames.
+    partial_log = log_file + ".part"
+    with open(partial_log, "w", encoding="utf-8") as log:
+        log.writelines(f"frame:{i} pts_time:{t:.6f}\nlavfi.scene_score={sc:.6f}\n"
+                       for i, (t, sc) in enumerate(zip(timestamps.tolist(), scores.tolist())))
+    os.replace(partial_log, log_file)
+    print("[SUCCESS] FFmpeg analysis complete.")
+    return timestamps, scores
+
+def parse_scene_log(log_file):
+    """
+    Reads the FFmpeg scene-score log in one go and returns (timestamps, scores) as float arrays.
+    Raises FileNotFoundError if the log does not exist.
+    """
+    with open(log_file, "rb") as f:
+        data = f.read()
+    return scene_arrays(SCENE_LOG_RE.findall(data))
+
+def scene_arrays(pairs):
+    """Turns (pts_time, scene_score) byte-string pairs into (timestamps, scores) float arrays."""
+    if not pairs:
+        return np.empty(0), np.empty(0)
+    values = np.array(pairs, dtype=np.float64)
+    return values[:, 0], values[:, 1]
+
+def find_most_active_clips(log_file, clip_duration_sec, num_clips, scoring_method='sum', scene_data=None):
     """
     (Legacy Method) Parses a log file to find the start times of the most active clips across the whole video.
     """
     print("\n--- PHASE 2: PARSING RESULTS (Standard Method)---")
     print(f"Finding the most active scenes from the analysis log using '{scoring_method}' scoring...")
-    scene_scores = {}
     try:
-        with open(log_file, "r") as f:
-            lines = f.readlines()
-            i = 0
-            while i < len(lines) - 1:
-                current_line, next_line = lines[i], lines[i+1]
-                if "pts_time:" in current_line and "lavfi.scene_score=" in next_line:
-                    try:
-                        time_str = [p for p in current_line.strip().split() if p.startswith("pts_time:")][0]
-                        timestamp = float(time_str.split(':')[1])
-                        score = float(next_line.strip().split('=')[1])
-                        interval_start = int(timestamp / clip_duration_sec) * clip_duration_sec
-                        if scoring_method == 'peak':
-                            current_peak = scene_scores.get(interval_start, 0)
-                            scene_scores[interval_start] = max(current_peak, score)
-                        else: # The default 'sum' method
-                            current_sum = scene_scores.get(interval_start, 0)
-                            scene_scores[interval_start] = current_sum + score
-                        i += 2
-                    except (ValueError, IndexError): i += 1
-                else: i += 1
+        timestamps, scores = scene_data if scene_data is not None else parse_scene_log(log_file)
     except FileNotFoundError:
         print(f"Error: Log file '{log_file}' not found. Analysis likely failed.")
         return []
 
-    if not scene_scores:
+    if scores.size == 0:
         print("[WARNING] Could not detect any motion with the current threshold.")
         print("          Try running again with a more sensitive (lower) --threshold value.")
         return []
-    sorted_clips = sorted(scene_scores.items(), key=operator.itemgetter(1), reverse=True)
-    print(f"[SUCCESS] Found {len(sorted_clips)} potential time windows. Selecting the top {num_clips}.")
-    return sorted([clip[0] for clip in sorted_clips[:num_clips]])
-
-def find_active_clips_by_routine(log_file, routine_path, num_clips, clip_duration):
+    # Bucket every score into its clip-length window and aggregate per window.
+    windows, window_idx = np.unique(np.trunc(timestamps / clip_duration_sec), return_inverse=True)
+    if scoring_method == 'peak':
+        window_scores = np.zeros(windows.size)
+        np.maximum.at(window_scores, window_idx, scores)
+    else: # The default 'sum' method
+        window_scores = np.bincount(window_idx, weights=scores, minlength=windows.size)
+    # Only the top few windows matter: partition out every window scoring at least
+    # the k-th best (ties included), then stable-sort just those so earlier windows
+    # still win ties like the previous dict-based ranking.
+    k = min(num_clips, window_scores.size)
+    candidates = np.arange(window_scores.size)
+    if 0 < k < window_scores.size:
+        kth_best = np.partition(window_scores, window_scores.size - k)[window_scores.size - k]
+        candidates = np.flatnonzero(window_scores >= kth_best)
+    ranked = candidates[np.argsort(-window_scores[candidates], kind='stable')]
+    print(f"[SUCCESS] Found {windows.size} potential time windows. Selecting the top {num_clips}.")
+    return sorted(float(windows[i]) * clip_duration_sec for i in ranked[:k])
+
+def find_active_clips_by_routine(log_file, routine_path, num_clips, clip_duration, scene_data=None):
     """
     Finds the most active clips, prioritizing unique exercises from the routine.yaml file.
     If not enough unique exercises are found, it fills the remaining slots with the next most-active clips.
@@ -181,33 +296,20 @@ def find_active_clips_by_routine(log_file, routine_path, num_clips, clip_duratio
     print("\n--- PHASE 2: PARSING RESULTS (Routine-Based Method) ---")
     
     # 1. Parse the FFmpeg log file to get all motion scores
-    all_scores = []
     try:
-        with open(log_file, "r") as f:
-            lines = f.readlines()
-            i = 0
-            while i < len(lines) - 1:
-                current_line, next_line = lines[i], lines[i+1]
-                if "pts_time:" in current_line and "lavfi.scene_score=" in next_line:
-                    try:
-                        time_str = [p for p in current_line.strip().split() if p.startswith("pts_time:")][0]
-                        timestamp = float(time_str.split(':')[1])
-                        score = float(next_line.strip().split('=')[1])
-                        all_scores.append({'ts': timestamp, 'score': score})
-                    except (ValueError, IndexError): pass
-                i += 2 # Process in pairs of lines
+        timestamps, scores = scene_data if scene_data is not None else parse_scene_log(log_file)
     except FileNotFoundError:
         print(f"[ERROR] Log file '{log_file}' not found. Analysis likely failed.")
         return []
 
-    if not all_scores:
+    if scores.size == 0:
         print("[WARNING] No motion frames were detected. Consider lowering the --threshold.")
         return []
     
     # 2. Parse the YAML routine file and define segment boundaries
     print(f"[INFO] Parsing routine from '{routine_path}'...")
     with open(routine_path, 'r') as f:
-        routine_data = yaml.safe_load(f)
+        routine_data = yaml.load(f, Loader=YamlLoader)
 
     segments = []
     current_time = 0.0
@@ -223,20 +325,24 @@ def find_active_clips_by_routine(log_file, routine_path, num_clips, clip_duratio
             'end': current_time + length,
             'is_action': is_action_segment,
             'total_score': 0.0,
-            'scores': []
         })
         current_time += length
     
     action_segments = [s for s in segments if s['is_action']]
     print(f"[INFO] Identified {len(action_segments)} action segments to analyze.")
     
-    # 3. Assign each score from the log to its corresponding segment
-    for score_event in all_scores:
-        for segment in action_segments:
-            if segment['start'] <= score_event['ts'] < segment['end']:
-                segment['scores'].append(score_event)
-                segment['total_score'] += score_event['score']
-                break 
+    # 3. Assign each score from the log to its corresponding segment. Segments are in
+    # timeline order, so a binary search finds the one starting at or before each score.
+    seg_starts = np.array([s['start'] for s in action_segments])
+    seg_ends = np.array([s['end'] for s in action_segments])
+    seg_idx = np.searchsorted(seg_starts, timestamps, side='right') - 1
+    in_segment = seg_idx >= 0
+    in_segment[in_segment] = timestamps[in_segment] < seg_ends[seg_idx[in_segment]]
+    seg_idx = np.where(in_segment, seg_idx, -1)
+    totals = np.bincount(seg_idx[in_segment], weights=scores[in_segment], minlength=len(action_segments))
+    for i, (segment, total) in enumerate(zip(action_segments, totals.tolist())):
+        segment['index'] = i
+        segment['total_score'] = total
     
     # 4. Select top segments with a preference for unique exercise names
     print("[INFO] Selecting segments with a preference for unique exercises...")
@@ -277,24 +383,19 @@ def find_active_clips_by_routine(log_file, routine_path, num_clips, clip_duratio
     # 5. For each top segment, find the highest-scoring clip within it
     final_start_times = []
     for segment in top_segments:
-        if not segment['scores']:
+        in_this = seg_idx == segment['index']
+        offsets = timestamps[in_this] - segment['start']
+        # Skip scores too close to the end for a full clip to fit in the segment.
+        fits = offsets <= (segment['end'] - segment['start'] - clip_duration)
+        if not fits.any():
             continue
-        
-        window_scores = {}
-        for score_event in segment['scores']:
-            offset_in_segment = score_event['ts'] - segment['start']
-            if offset_in_segment > (segment['end'] - segment['start'] - clip_duration):
-                continue
-            
-            window_start_time = segment['start'] + (int(offset_in_segment / clip_duration) * clip_duration)
-            
-            current_score = window_scores.get(window_start_time, 0)
-            window_scores[window_start_time] = current_score + score_event['score']
 
-        if window_scores:
-            best_clip_start_time = max(window_scores, key=window_scores.get)
-            final_start_times.append(best_clip_start_time)
-            print(f"  -> Found best clip in '{segment['name']}' starting at {best_clip_start_time:.2f}s")
+        windows, window_idx = np.unique(np.trunc(offsets[fits] / clip_duration), return_inverse=True)
+        window_scores = np.bincount(window_idx, weights=scores[in_this][fits], minlength=windows.size)
+        # argmax keeps the earliest window on ties, like the previous dict ranking.
+        best_clip_start_time = segment['start'] + float(windows[np.argmax(window_scores)]) * clip_duration
+        final_start_times.append(best_clip_start_time)
+        print(f"  -> Found best clip in '{segment['name']}' starting at {best_clip_start_time:.2f}s")
             
     if not final_start_times:
         print("[WARNING] Could not find any high-motion clips within the top segments.")
@@ -303,6 +404,13 @@ def find_active_clips_by_routine(log_file, routine_path, num_clips, clip_duratio
     print(f"\n[SUCCESS] Selected {len(final_start_times)} clip start times for the final video.")
     return sorted(final_start_times)
 
+def clip_input_args(input_file, start_times, clip_duration, decode_args=()):
+    """One input-seeked `-i` per clip, so a single ffmpeg reads only the clip windows."""
+    args = []
+    for start_time in start_times:
+        args.extend([*decode_args, "-ss", str(start_time), "-t", str(clip_duration), "-i", input_file])
+    return args
+
 def extract_and_combine(input_file, start_times, clip_duration, output_file, encoder, speed_factor=1.0):
     print("\n--- PHASE 3: EXTRACTING & COMBINING CLIPS ---")
     if speed_factor > 1.0:
@@ -310,49 +418,40 @@ def extract_and_combine(input_file, start_times, clip_duration, output_file, enc
     else:
         print("Using stream copy for fast video extraction (no re-encoding).")
 
-    with tempfile.TemporaryDirectory() as tempdir:
-        temp_files_for_concat = []
-        for i, start_time in enumerate(start_times):
-            temp_filename = os.path.join(tempdir, f"temp_clip_{i+1}.mp4")
-            print(f"\n[INFO] Extracting clip {i+1} of {len(start_times)} (starts at {start_time:.2f}s)...")
-            command_extract = ["ffmpeg", "-y", "-ss", str(start_time), "-i", input_file, "-t", str(clip_duration), "-c", "copy", "-an", temp_filename]
-            try:
-                subprocess.run(command_extract, check=True, capture_output=True)
-                print(f"[SUCCESS] Clip {i+1} extracted.")
-                temp_files_for_concat.append(temp_filename)
-            except subprocess.CalledProcessError as e:
-                print(f"\n[ERROR] Failed to extract clip at {start_time:.2f}s:\n{e.stderr.decode()}")
-                continue
-
-        if not temp_files_for_concat:
-            print("[ERROR] No clips were successfully extracted. Final video cannot be created.")
-            return False
-
-        print("\n[INFO] Stitching final video...")
-        
-        if speed_factor > 1.0:
-            concat_cmd = ["ffmpeg", "-y"]
-            for f in temp_files_for_concat: concat_cmd.extend(["-i", f])
-            concat_inputs = "".join([f"[{i}:v]" for i in range(len(temp_files_for_concat))])
-            filter_complex = f"{concat_inputs}concat=n={len(temp_files_for_concat)}:v=1:a=0[cat];[cat]setpts=PTS/{speed_factor:.4f}[v]"
-            concat_cmd.extend(["-filter_complex", filter_complex, "-map", "[v]"])
-            concat_cmd.extend(["-c:v", "libx264", "-preset", "veryfast", "-crf", "23"])
-            concat_cmd.append(output_file)
-        else:
-            file_list_path = os.path.join(tempdir, "files.txt")
-            with open(file_list_path, "w") as f:
-                for temp_file in temp_files_for_concat:
-                    f.write(f"file '{temp_file.replace(os.sep, '/')}'\n")
-            concat_cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", file_list_path, "-c", "copy", output_file]
+    # All clips are cut and joined by one ffmpeg process straight from the source,
+    # instead of one extraction process per clip plus a join over temp files.
+    print(f"\n[INFO] Extracting and stitching {len(start_times)} clips...")
+    concat_list = None
 
-        try:
-            subprocess.run(concat_cmd, check=True, capture_output=True)
-            print("[SUCCESS] Final video stitched.")
-        except subprocess.CalledProcessError as e:
-            error_message = e.stderr.decode() if e.stderr else "Unknown FFmpeg concat error."
-            full_command_str = ' '.join(shlex.quote(c) for c in concat_cmd)
-            print(f"[ERROR] Failed to combine clips.\nFull Command: {full_command_str}\nError: {error_message}")
-            return False
+    if speed_factor > 1.0:
+        concat_cmd = [*FFMPEG_QUIET, *clip_input_args(input_file, start_times, clip_duration)]
+        concat_inputs = "".join([f"[{i}:v]" for i in range(len(start_times))])
+        filter_complex = f"{concat_inputs}concat=n={len(start_times)}:v=1:a=0[cat];[cat]setpts=PTS/{speed_factor:.4f}[v]"
+        concat_cmd.extend(["-filter_complex", filter_complex, "-map", "[v]"])
+        concat_cmd.extend(["-c:v", "libx264", "-preset", "veryfast", "-crf", "23"])
+        concat_cmd.append(output_file)
+    else:
+        # The concat demuxer cuts each clip out of the source with inpoint/
+        # outpoint, so stream copy needs no intermediate clip files. The list
+        # itself is fed on stdin rather than written to a temp file.
+        # Quoted for the concat list: a ' inside the path is written as '\''.
+        source = Path(input_file).resolve().as_posix().replace("'", "'\\''")
+        concat_list = "".join(
+            f"file '{source}'\ninpoint {start_time}\noutpoint {start_time + clip_duration}\n"
+            for start_time in start_times
+        ).encode("utf-8")
+        concat_cmd = [*FFMPEG_QUIET, "-f", "concat", "-safe", "0", "-protocol_whitelist", "file,pipe",
+                      "-i", "pipe:0", "-c", "copy", "-an", output_file]
+
+    try:
+        subprocess.run(concat_cmd, check=True, capture_output=True,
+                       input=concat_list, stdin=None if concat_list is not None else subprocess.DEVNULL)
+        print("[SUCCESS] Final video stitched.")
+    except subprocess.CalledProcessError as e:
+        error_message = e.stderr.decode() if e.stderr else "Unknown FFmpeg concat error."
+        full_command_str = ' '.join(shlex.quote(c) for c in concat_cmd)
+        print(f"[ERROR] Failed to combine clips.\nFull Command: {full_command_str}\nError: {error_message}")
+        return False
             
     print(f"\n-------------------------------------------------\n         PROCESS COMPLETE\nYour hook video has been saved as: {output_file}\n-------------------------------------------------")
     return True
@@ -366,58 +465,45 @@ def extract_and_fade_combine(input_file, start_times, clip_duration, output_file
     if speed_factor > 1.0:
         print(f"Applying {speed_factor:.2f}x speed up to the final video.")
 
-    with tempfile.TemporaryDirectory() as tempdir:
-        temp_files_for_concat = []
-        for i, start_time in enumerate(start_times):
-            temp_filename = os.path.join(tempdir, f"temp_clip_{i+1}.mp4")
-            print(f"\n[INFO] Extracting clip {i+1} of {len(start_times)} (starts at {start_time:.2f}s)...")
-            command_extract = ["ffmpeg", "-y", "-ss", str(start_time), "-i", input_file, "-t", str(clip_duration), "-an", temp_filename]
-            try:
-                subprocess.run(command_extract, check=True, capture_output=True)
-                print(f"[SUCCESS] Clip {i+1} extracted.")
-                temp_files_for_concat.append(temp_filename)
-            except subprocess.CalledProcessError as e:
-                print(f"\n[ERROR] Failed to extract clip at {start_time:.2f}s:\n{e.stderr.decode()}")
-                continue
-
-        if not temp_files_for_concat:
-            print("[ERROR] No clips were successfully extracted. Final video cannot be created.")
-            return False
-
-        print("\n[INFO] Building filtergraph for transitions and stitching final video...")
-        command_concat = ["ffmpeg", "-y"]
-        if 'nvenc' in encoder:
-            command_concat.extend(['-init_hw_device', f'cuda=cuda:{cuda_device}'])
-            command_concat.extend(['-filter_hw_device', 'cuda'])
-        for f in temp_files_for_concat: command_concat.extend(["-i", f])
-        
-        filter_complex = ""
-        fade_end_point = clip_duration - fade_duration
-        for i in range(len(temp_files_for_concat)):
-            filter_complex += f"[{i}:v]fade=type=out:start_time={fade_end_point}:duration={fade_duration}:color=white[v{i}_fadeout];"
-            if i > 0: filter_complex += f"[v{i}_fadeout]fade=type=in:start_time=0:duration={fade_duration}:color=white[v{i}_final];"
-            else: filter_complex += f"[v{i}_fadeout]null[v{i}_final];"
-        
-        concat_inputs = "".join([f"[v{i}_final]" for i in range(len(temp_files_for_concat))])
-        
-        speed_filter = f"setpts=PTS/{speed_factor:.4f}" if speed_factor > 1.0 else "null"
-        
-        if use_gpu_encoder:
-            filter_complex += f"{concat_inputs}concat=n={len(temp_files_for_concat)}:v=1:a=0[v_cat]; [v_cat]{speed_filter},format=yuv420p,hwupload[v]"
-            command_concat.extend(["-c:v", encoder])
-            if 'nvenc' in encoder: command_concat.extend(['-preset', 'fast'])
-        else:
-            filter_complex += f"{concat_inputs}concat=n={len(temp_files_for_concat)}:v=1:a=0[v_cat]; [v_cat]{speed_filter}[v]"
-            command_concat.extend(["-c:v", encoder, "-preset", "veryfast", "-crf", "23"])
-            
-        command_concat.extend(["-filter_complex", filter_complex, "-map", "[v]", output_file])
-        try:
-            subprocess.run(command_concat, check=True, capture_output=True)
-            print("[SUCCESS] Final video with transitions stitched.")
-        except subprocess.CalledProcessError as e:
-            error_message = e.stderr.decode() if e.stderr else "Unknown FFmpeg concat error."
-            print(f"[ERROR] Failed to combine clips with transitions.\nFull Command: {' '.join(shlex.quote(c) for c in command_concat)}\nError:\n{error_message}")
-            return False
+    # Each clip is an input-seeked window of the source feeding the same graph,
+    # so clips are decoded once and encoded once (no intermediate clip encode).
+    print(f"\n[INFO] Building filtergraph for {len(start_times)} clips with transitions and stitching final video...")
+    # With NVENC the clips are also decoded on that GPU (NVDEC). The fades and
+    # concat have no CUDA equivalents, so decoded frames come back to system
+    # memory once and the graph stays on the CPU.
+    decode_args = ("-hwaccel", "cuda", "-hwaccel_device", str(cuda_device)) if 'nvenc' in encoder else ()
+    command_concat = [*FFMPEG_QUIET, *clip_input_args(input_file, start_times, clip_duration, decode_args)]
+
+    filter_complex = ""
+    fade_end_point = clip_duration - fade_duration
+    for i in range(len(start_times)):
+        filter_complex += f"[{i}:v]fade=type=out:start_time={fade_end_point}:duration={fade_duration}:color=white[v{i}_fadeout];"
+        if i > 0: filter_complex += f"[v{i}_fadeout]fade=type=in:start_time=0:duration={fade_duration}:color=white[v{i}_final];"
+        else: filter_complex += f"[v{i}_fadeout]null[v{i}_final];"
+
+    concat_inputs = "".join([f"[v{i}_final]" for i in range(len(start_times))])
+
+    speed_filter = f"setpts=PTS/{speed_factor:.4f}" if speed_factor > 1.0 else "null"
+
+    if use_gpu_encoder:
+        # No filter here runs on the GPU, so frames go to the encoder from system
+        # memory; a hwupload would only add a device copy (and needs a device the
+        # non-NVENC encoders never had).
+        filter_complex += f"{concat_inputs}concat=n={len(start_times)}:v=1:a=0[v_cat]; [v_cat]{speed_filter},format=yuv420p[v]"
+        command_concat.extend(["-c:v", encoder])
+        if 'nvenc' in encoder: command_concat.extend(['-preset', 'fast', '-gpu', str(cuda_device)])
+    else:
+        filter_complex += f"{concat_inputs}concat=n={len(start_times)}:v=1:a=0[v_cat]; [v_cat]{speed_filter}[v]"
+        command_concat.extend(["-c:v", encoder, "-preset", "veryfast", "-crf", "23"])
+
+    command_concat.extend(["-filter_complex", filter_complex, "-map", "[v]", output_file])
+    try:
+        subprocess.run(command_concat, check=True, capture_output=True)
+        print("[SUCCESS] Final video with transitions stitched.")
+    except subprocess.CalledProcessError as e:
+        error_message = e.stderr.decode() if e.stderr else "Unknown FFmpeg concat error."
+        print(f"[ERROR] Failed to combine clips with transitions.\nFull Command: {' '.join(shlex.quote(c) for c in command_concat)}\nError:\n{error_message}")
+        return False
     print(f"\n-------------------------------------------------\n         PROCESS COMPLETE\nYour hook video has been saved as: {output_file}\n-------------------------------------------------")
     return True
 
@@ -449,8 +535,9 @@ def main():
 
     adv_group = parser.add_argument_group('Performance and Advanced Options')
     adv_group.add_argument('--max_duration', type=float, help="Maximum final video duration. Speeds up the video to fit if needed.")
-    adv_group.add_argument("--gpu", action=argparse.BooleanOptionalAction, default=True, help="Use GPU (OpenCL) for the analysis phase. Does not affect encoding. Default is on.")
-    adv_group.add_argument("--cl_device", type=str, default="0.0", help="The OpenCL device to use for analysis. (default: 0.0)")
+    adv_group.add_argument("--gpu", action=argparse.BooleanOptionalAction, default=True, help="Use GPU hardware decoding for the analysis phase. Does not affect encoding. Default is on.")
+    adv_group.add_argument("--analysis_jobs", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="Number of FFmpeg processes that analyze time shards of a long video in parallel. 1 disables sharding.")
+    adv_group.add_argument("--cl_device", type=str, default="0.0", help="Deprecated and ignored; analysis no longer uses an OpenCL device.")
     adv_group.add_argument('--transition', choices=[None, 'white'], default='white', help="Adds a 'dip to white' transition. This requires re-encoding.")
     adv_group.add_argument('--encoder', type=str, default='hevc_nvenc', help="Video encoder for transitions. HW options: h264_nvenc, hevc_nvenc (NVIDIA), h264_videotoolbox (macOS), h264_amf (AMD). (default: hevc_nvenc)")
     adv_group.add_argument('--scoring', choices=['sum', 'peak'], default='sum', help="[Legacy] Scoring method for non-routine analysis. 'sum' for sustained action, 'peak' for spikes. Default: sum.")
@@ -462,28 +549,35 @@ def main():
     if not os.path.exists(args.input): sys.exit(f"Error: Input file not found at '{args.input}'")
     if args.routine and not os.path.exists(args.routine): sys.exit(f"Error: Routine file not found at '{args.routine}'")
     if not check_ffmpeg(): sys.exit(1)
+    # Check the transition encoder now rather than after the (long) analysis phase.
+    if args.transition == 'white' and args.encoder != 'libx264' and not encoder_works(args.encoder, args.cuda_device):
+        print(f"[WARNING] Encoder '{args.encoder}' is not usable on this system. Falling back to 'libx264'.")
+        args.encoder = 'libx264'
     
     log_file_path = "scene_scores_temp.log"
     video_created_successfully = False
     
+    scene_data = None
     if os.path.exists(log_file_path):
         print(f"\n[INFO] Found existing '{log_file_path}'. Skipping analysis phase.")
         analysis_completed = True
     else:
-        analysis_completed = analyze_video(
-            args.input, args.threshold, args.gpu, args.cl_device, 
-            start_time=args.start, end_time=args.end, center_focus=args.center_focus
+        scene_data = analyze_video(
+            args.input, args.threshold, args.gpu, 
+            start_time=args.start, end_time=args.end, center_focus=args.center_focus,
+            log_file=log_file_path, jobs=args.analysis_jobs
         )
+        analysis_completed = scene_data is not None
 
     if analysis_completed:
         start_times = []
         if args.routine:
             start_times = find_active_clips_by_routine(
-                log_file_path, args.routine, args.num_clips, args.clip_duration
+                log_file_path, args.routine, args.num_clips, args.clip_duration, scene_data=scene_data
             )
         else:
             start_times = find_most_active_clips(
-                log_file_path, args.clip_duration, args.num_clips, scoring_method=args.scoring
+                log_file_path, args.clip_duration, args.num_clips, scoring_method=args.scoring, scene_data=scene_data
             )
         
         if start_times:
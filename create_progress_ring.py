@@ -5,6 +5,7 @@ import random
 import argparse
 import subprocess
 import shutil
+from multiprocessing import Pool
 from PIL import Image, ImageDraw, ImageFont
 
 # --- Helper Functions ---
@@ -65,6 +66,109 @@ def draw_countdown_text(draw, center_xy, remaining_seconds, font, **kwargs):
     # Draw the main text on top
     draw.text(center_xy, text, font=font, fill=fill_color, anchor="mm")
 
+def load_countdown_font(font_path, font_size, font_style, verbose=False):
+    """Loads the countdown font at the given size, applying a variable-font style when available."""
+    try:
+        font = ImageFont.truetype(font_path, font_size)
+        if verbose: print(f"Successfully loaded font: {font_path}")
+        if font_style and hasattr(font, 'get_variation_names'):
+            target_style_b = font_style.encode('utf-8')
+            if target_style_b in font.get_variation_names():
+                font.set_variation_by_name(target_style_b)
+                if verbose: print(f"-> Set font style to: '{font_style}'")
+    except IOError:
+        if verbose: print(f"Warning: Font not found at '{font_path}'. Falling back to default.")
+        font = ImageFont.load_default()
+    return font
+
+# --- Parallel Frame Rendering ---
+
+# Per-worker state, set up once by _init_frame_worker instead of being sent with every frame.
+_frame_ctx = None
+
+def _image_state(image):
+    """Raw (mode, size, bytes) form of an image, cheap to hand to worker processes."""
+    return (image.mode, image.size, image.tobytes())
+
+def _init_frame_worker(ctx):
+    """Rebuilds the pre-rendered layers and loads the font once per worker process."""
+    global _frame_ctx
+    _frame_ctx = dict(ctx)
+    _frame_ctx['trail_ring_layer'] = Image.frombytes(*ctx['trail_ring_layer'])
+    _frame_ctx['gradient_ring_layer'] = Image.frombytes(*ctx['gradient_ring_layer'])
+    if ctx['circle_layer'] is not None:
+        _frame_ctx['circle_layer'] = Image.frombytes(*ctx['circle_layer'])
+    if ctx['font'] is not None:
+        _frame_ctx['font'] = load_countdown_font(*ctx['font'])
+    _frame_ctx['center_tiles'] = {}
+
+def _center_tile(remaining_seconds):
+    """
+    Background circle plus stroked countdown number for one second of the timer.
+    The number only changes once per second, so each tile is drawn once per worker
+    and reused for every frame of that second instead of redrawing the stroke.
+    """
+    ctx = _frame_ctx
+    tile = ctx['center_tiles'].get(remaining_seconds)
+    if tile is None:
+        tile = Image.new('RGBA', (ctx['size'], ctx['size']), (0, 0, 0, 0))
+        if ctx['circle_layer'] is not None:
+            tile.alpha_composite(ctx['circle_layer'])
+        if remaining_seconds is not None:
+            draw_countdown_text(ImageDraw.Draw(tile), ctx['center_point'], remaining_seconds, ctx['font'], stroke_width=ctx['text_stroke_width'])
+        ctx['center_tiles'][remaining_seconds] = tile
+    return tile
+
+def _render_frame(i):
+    """Composes and saves frame `i` of the ring animation."""
+    ctx = _frame_ctx
+    size, total_frames = ctx['size'], ctx['total_frames']
+    box_outer, box_color, box_inner = ctx['box_outer'], ctx['box_color'], ctx['box_inner']
+    border_width, stroke_width = ctx['border_width'], ctx['stroke_width']
+
+    # Start with the trail ring as the base for every frame
+    frame_image = ctx['trail_ring_layer'].copy()
+    
+    # Create a mask. It will be left black for the final frame to prevent artifacts.
+    mask = Image.new('L', (size, size), 0)
+
+    # CORRECTED LOGIC: Stop drawing the mask on the final frame of the video segment.
+    # For a 300-frame video (indices 0-299), we stop drawing the mask at frame 299.
+    if i < (total_frames -1):
+        draw_on_mask = ImageDraw.Draw(mask)
+
+        # Calculate the angle range for the *visible* part of the gradient
+        dir_mult = 1 if ctx['direction'] == 'clockwise' else -1
+        current_progress_angle = i * ctx['angle_per_frame'] * dir_mult
+        
+        # Angles for the mask arc
+        start_mask_angle = -90 + current_progress_angle
+        end_mask_angle = -90 + (360 * dir_mult)
+        
+        # Draw a white shape on the mask corresponding to the remaining time
+        if border_width > 0:
+            draw_ring_segment(draw_on_mask, box_outer, start_mask_angle, end_mask_angle, 255, border_width)
+        draw_ring_segment(draw_on_mask, box_color, start_mask_angle, end_mask_angle, 255, stroke_width)
+        if border_width > 0:
+            draw_ring_segment(draw_on_mask, box_inner, start_mask_angle, end_mask_angle, 255, border_width)
+
+    # Paste the gradient layer onto the base using the generated mask.
+    frame_image.paste(ctx['gradient_ring_layer'], (0, 0), mask)
+    
+    # Background circle and countdown text on top of all other layers
+    remaining_seconds = None
+    if ctx['font'] is not None:
+        remaining_seconds = ctx['duration'] - (i // ctx['fps'])
+        # Only draw the number if we're not hiding it when it hits zero
+        if ctx['hide_on_zero'] and remaining_seconds <= 0:
+            remaining_seconds = None
+    if remaining_seconds is not None or ctx['circle_layer'] is not None:
+        frame_image.alpha_composite(_center_tile(remaining_seconds))
+    
+    # Save the final composed frame
+    frame_image.save(os.path.join(ctx['output_folder'], f'frame_{i:05d}.png'))
+    return i
+
 # --- Main Program Logic (Optimized and Corrected) ---
 
 def create_progress_ring(
@@ -98,25 +202,18 @@ def create_progress_ring(
     circle_padding = circle_cfg.get('padding', 0)
 
     # --- Font Loading ---
-    used_font = None
+    font_spec = None
     if not no_text:
-        try:
-            total_visible_width = stroke_width + (border_width * 2)
-            outer_margin = 4
-            inner_space_radius = (size / 2) - outer_margin - total_visible_width
-            usable_text_diameter = (inner_space_radius - circle_padding) * 2
-            calculated_font_size = int(usable_text_diameter * font_cfg['font_size_ratio'])
-
-            used_font = ImageFont.truetype(font_path, calculated_font_size)
-            print(f"Successfully loaded font: {font_path}")
-            if font_style and hasattr(used_font, 'get_variation_names'):
-                target_style_b = font_style.encode('utf-8')
-                if target_style_b in used_font.get_variation_names():
-                    used_font.set_variation_by_name(target_style_b)
-                    print(f"-> Set font style to: '{font_style}'")
-        except IOError:
-            print(f"Warning: Font not found at '{font_path}'. Falling back to default.")
-            used_font = ImageFont.load_default()
+        total_visible_width = stroke_width + (border_width * 2)
+        outer_margin = 4
+        inner_space_radius = (size / 2) - outer_margin - total_visible_width
+        usable_text_diameter = (inner_space_radius - circle_padding) * 2
+        calculated_font_size = int(usable_text_diameter * font_cfg['font_size_ratio'])
+
+        # Loaded here once for the log messages; each worker loads its own copy
+        # since a font with a variation style set doesn't survive pickling.
+        load_countdown_font(font_path, calculated_font_size, font_style, verbose=True)
+        font_spec = (font_path, calculated_font_size, font_style)
             
     # --- Color & Geometry Setup ---
     start_color = generate_base_color()
@@ -170,66 +267,41 @@ def create_progress_ring(
             draw_ring_segment(draw_on_gradient, box_inner, start_angle, end_angle, 'black', border_width)
     print("-> Pre-rendered full gradient ring layer.")
 
-    # --- Frame Generation Loop (using masking) ---
-    for i in range(total_frames):
-        # Start with the trail ring as the base for every frame
-        frame_image = trail_ring_layer.copy()
-        
-        # Create a mask. It will be left black for the final frame to prevent artifacts.
-        mask = Image.new('L', (size, size), 0)
-
-        # CORRECTED LOGIC: Stop drawing the mask on the final frame of the video segment.
-        # For a 300-frame video (indices 0-299), we stop drawing the mask at frame 299.
-        if i < (total_frames -1):
-            draw_on_mask = ImageDraw.Draw(mask)
-
-            # Calculate the angle range for the *visible* part of the gradient
-            dir_mult = 1 if direction == 'clockwise' else -1
-            current_progress_angle = i * angle_per_frame * dir_mult
-            
-            # Angles for the mask arc
-            start_mask_angle = -90 + current_progress_angle
-            end_mask_angle = -90 + (360 * dir_mult)
-            
-            # Draw a white shape on the mask corresponding to the remaining time
-            if border_width > 0:
-                draw_ring_segment(draw_on_mask, box_outer, start_mask_angle, end_mask_angle, 255, border_width)
-            draw_ring_segment(draw_on_mask, box_color, start_mask_angle, end_mask_angle, 255, stroke_width)
-            if border_width > 0:
-                draw_ring_segment(draw_on_mask, box_inner, start_mask_angle, end_mask_angle, 255, border_width)
-
-        # Paste the gradient layer onto the base using the generated mask.
-        frame_image.paste(gradient_ring_layer, (0, 0), mask)
-        
-        # Get a draw context for the composited image
-        draw_on_frame = ImageDraw.Draw(frame_image)
-        
-        # Draw background circle if enabled
-        if not no_text and circle_enabled:
-            total_ring_width = stroke_width + (border_width * 2)
-            circle_radius = (size / 2) - outer_margin - total_ring_width
-            
-            circle_layer = Image.new('RGBA', (size, size), (0, 0, 0, 0))
-            draw_on_circle = ImageDraw.Draw(circle_layer)
-            cx, cy = center_point
-            box = (cx - circle_radius, cy - circle_radius, cx + circle_radius, cy + circle_radius)
-            circle_color = parse_color_with_alpha(circle_cfg.get('color', 'black@0.7'))
-            draw_on_circle.ellipse(box, fill=circle_color)
-            frame_image.alpha_composite(circle_layer)
-        
-        # Draw countdown text on top of all other layers
-        if not no_text:
-            remaining_seconds = duration - (i // fps)
-            # Only draw the number if we're not hiding it when it hits zero
-            if not (hide_on_zero and remaining_seconds <= 0):
-                 draw_countdown_text(draw_on_frame, center_point, remaining_seconds, used_font, stroke_width=text_stroke_width)
+    # 3. The background circle is the same on every frame, so it is drawn once too.
+    circle_layer = None
+    if not no_text and circle_enabled:
+        total_ring_width = stroke_width + (border_width * 2)
+        circle_radius = (size / 2) - outer_margin - total_ring_width
         
-        # Save the final composed frame
-        frame_path = os.path.join(output_folder, f'frame_{i:05d}.png')
-        frame_image.save(frame_path)
+        circle_layer = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+        draw_on_circle = ImageDraw.Draw(circle_layer)
+        cx, cy = center_point
+        box = (cx - circle_radius, cy - circle_radius, cx + circle_radius, cy + circle_radius)
+        circle_color = parse_color_with_alpha(circle_cfg.get('color', 'black@0.7'))
+        draw_on_circle.ellipse(box, fill=circle_color)
 
-        sys.stdout.write(f"\r-> Generating frame {i+1}/{total_frames} ({int((i+1)/total_frames*100)}%)")
-        sys.stdout.flush()
+    # --- Frame Generation (using masking) ---
+    # Every frame depends only on its index and the layers above, so frames are
+    # composed and PNG-encoded across all cores. Workers receive the layers once
+    # at start-up rather than with every frame.
+    frame_ctx = {
+        'size': size, 'total_frames': total_frames, 'duration': duration, 'fps': fps,
+        'direction': direction, 'angle_per_frame': angle_per_frame,
+        'border_width': border_width, 'stroke_width': stroke_width,
+        'box_outer': box_outer, 'box_color': box_color, 'box_inner': box_inner,
+        'center_point': center_point, 'hide_on_zero': hide_on_zero,
+        'text_stroke_width': text_stroke_width, 'font': font_spec,
+        'output_folder': output_folder,
+        'trail_ring_layer': _image_state(trail_ring_layer),
+        'gradient_ring_layer': _image_state(gradient_ring_layer),
+        'circle_layer': _image_state(circle_layer) if circle_layer is not None else None,
+    }
+    workers = min(os.cpu_count() or 1, total_frames)
+    chunksize = max(1, total_frames // (workers * 4))
+    with Pool(workers, initializer=_init_frame_worker, initargs=(frame_ctx,)) as pool:
+        for done, _ in enumerate(pool.imap_unordered(_render_frame, range(total_frames), chunksize=chunksize), 1):
+            sys.stdout.write(f"\r-> Generating frame {done}/{total_frames} ({int(done/total_frames*100)}%)")
+            sys.stdout.flush()
 
     print("\n--- PNG Frame Generation Complete ---")
 